@@ -34,10 +34,32 @@ def create_app(config_name=None):
     # Register error handlers
     register_error_handlers(app)
 
+    # Register CLI commands
+    from app.commands import menudb_cli
+    app.cli.add_command(menudb_cli)
+
+    # Keep dish_summaries and the change feed in sync with every flush
+    from app import summaries, changes  # noqa: F401
+
     # Create tables
     with app.app_context():
+        from app.writer import init_sqlite_engine
+        init_sqlite_engine(db.engine, app.config['SQLITE_BUSY_TIMEOUT'])
+
         db.create_all()
         init_master_data()
+        init_dish_summaries()
+        init_change_log()
+
+    # Scheduled online backups
+    if app.config['BACKUP_INTERVAL_HOURS'] > 0 and not app.testing:
+        from app.backup import start_backup_scheduler
+        start_backup_scheduler(app)
+
+    # Load the search index in the background so no request waits for it
+    if not app.testing:
+        from app.facets import start_dish_index_build
+        start_dish_index_build(app)
 
     return app
 
@@ -80,6 +102,32 @@ def init_master_data():
     db.session.commit()
 
 
+def init_dish_summaries():
+    """Backfill dish_summaries for databases created before it existed"""
+    from app.models import Dish, DishSummary
+    from app.summaries import rebuild_dish_summaries
+
+    if DishSummary.query.first() is not None or Dish.query.first() is None:
+        return
+
+    rebuild_dish_summaries(db.session.connection())
+    db.session.commit()
+
+
+def init_change_log():
+    """Seed the change feed for databases created before it existed"""
+    from app.models import ChangeLog, Dish, Ingredient
+    from app.changes import seed_change_log
+
+    if ChangeLog.query.first() is not None:
+        return
+    if Dish.query.first() is None and Ingredient.query.first() is None:
+        return
+
+    seed_change_log(db.session.connection())
+    db.session.commit()
+
+
 def register_error_handlers(app):
     """Register error handlers"""
     from flask import render_template
@@ -0,0 +1,213 @@
+"""Online backups using the SQLite backup API.
+
+The database is copied a few pages at a time with a short sleep between
+steps, so the app's readers and writers keep running while a backup is in
+progress. A write from any other connection makes SQLite restart the stepped
+copy from the first page, so under steady writes it would never finish:
+after ``max_restarts`` restarts the copy falls back to a single step, which
+holds one read transaction for the whole copy. In WAL mode (see
+app/writer.py) that does not block writers. Each snapshot is checked with ``PRAGMA integrity_check`` before it
+replaces the temporary name, and only the newest ``keep`` snapshots are kept.
+"""
+import fcntl
+import glob
+import os
+import sqlite3
+import threading
+import time
+from datetime import datetime
+
+from app import db
+
+BACKUP_PREFIX = 'menudb-'
+BACKUP_SUFFIX = '.db'
+SCHEDULER_LOCK = '.scheduler.lock'
+
+
+class BackupError(Exception):
+    """Raised when a snapshot cannot be taken or fails its integrity check"""
+
+
+class _CopyRestarted(Exception):
+    """Aborts a stepped copy that keeps restarting"""
+
+
+# The queries behind one /edit page: the pagination count and a page from
+# the middle of the updated_at ordering
+PROBE_COUNT_SQL = 'SELECT count(*) FROM dish_summaries'
+PROBE_PAGE_SQL = (
+    'SELECT id, name, difficulty, genre_names, ingredient_names, ingredient_count '
+    'FROM dish_summaries ORDER BY updated_at DESC LIMIT 10 OFFSET ?'
+)
+BASELINE_SAMPLES = 5
+
+
+def _probe(conn):
+    """Time the reads of one /edit page, as a stand-in for a request"""
+    started = time.perf_counter()
+    total = conn.execute(PROBE_COUNT_SQL).fetchone()[0]
+    conn.execute(PROBE_PAGE_SQL, (total // 2,)).fetchall()
+    return (time.perf_counter() - started) * 1000
+
+
+def backup_database(source_path, backup_dir, pages_per_step=256, step_sleep=0.01, keep=7,
+                    max_restarts=3):
+    """Take one online snapshot of ``source_path`` into ``backup_dir``.
+
+    Returns a report dict: snapshot path, size, pages, steps, how often the
+    stepped copy restarted and whether it fell back to a single step,
+    elapsed time and the latency of a probe read (one /edit page) with no
+    backup running and between backup steps.
+    """
+    os.makedirs(backup_dir, exist_ok=True)
+    stamp = datetime.now().strftime('%Y%m%d-%H%M%S-%f')
+    final_path = os.path.join(backup_dir, f'{BACKUP_PREFIX}{stamp}{BACKUP_SUFFIX}')
+    temp_path = final_path + '.part'
+
+    source = sqlite3.connect(source_path)
+    probe = sqlite3.connect(source_path)
+    dest = sqlite3.connect(temp_path)
+    # Median of a few probes before copying anything; the first one also
+    # warms the page cache the way a running app would have
+    baseline = sorted(_probe(probe) for _ in range(BASELINE_SAMPLES))
+    baseline_ms = baseline[len(baseline) // 2]
+    probes_ms = []
+    steps = 0
+    total_pages = 0
+    copied = 0
+    restarts = 0
+    single_step = False
+
+    def progress(status, remaining, total):
+        nonlocal steps, total_pages, copied, restarts
+        steps += 1
+        total_pages = total
+        # Progress only grows within one pass; a restart starts over at page 1
+        if total - remaining <= copied:
+            restarts += 1
+            if restarts > max_restarts:
+                raise _CopyRestarted
+        copied = total - remaining
+        probes_ms.append(_probe(probe))
+        if remaining:
+            time.sleep(step_sleep)
+
+    started = time.perf_counter()
+    try:
+        try:
+            source.backup(dest, pages=pages_per_step, progress=progress)
+        except _CopyRestarted:
+            single_step = True
+            try:
+                source.backup(dest)
+            except sqlite3.Error as e:
+                raise BackupError(f'single-step copy failed: {e}') from e
+            total_pages = dest.execute('PRAGMA page_count').fetchone()[0]
+        elapsed = time.perf_counter() - started
+
+        result = dest.execute('PRAGMA integrity_check').fetchone()[0]
+        if result != 'ok':
+            raise BackupError(f'integrity_check failed: {result}')
+    except Exception:
+        dest.close()
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+    finally:
+        source.close()
+        probe.close()
+
+    dest.close()
+    os.replace(temp_path, final_path)
+    removed = rotate_backups(backup_dir, keep)
+
+    return {
+        'path': final_path,
+        'size_bytes': os.path.getsize(final_path),
+        'pages': total_pages,
+        'steps': steps,
+        'restarts': restarts,
+        'single_step': single_step,
+        'elapsed_sec': round(elapsed, 3),
+        'probe_baseline_ms': round(baseline_ms, 3),
+        'probe_avg_ms': round(sum(probes_ms) / len(probes_ms), 3) if probes_ms else None,
+        'probe_max_ms': round(max(probes_ms), 3) if probes_ms else None,
+        'rotated': removed,
+    }
+
+
+def rotate_backups(backup_dir, keep):
+    """Delete all but the newest ``keep`` snapshots; returns removed paths"""
+    snapshots = sorted(glob.glob(os.path.join(backup_dir, f'{BACKUP_PREFIX}*{BACKUP_SUFFIX}')))
+    removed = snapshots[:-keep] if keep > 0 else []
+    for path in removed:
+        os.remove(path)
+    return removed
+
+
+def get_backup_dir(app):
+    return app.config['BACKUP_DIR'] or os.path.join(
+        os.path.dirname(get_database_file(app)), 'backups'
+    )
+
+
+def get_database_file(app):
+    """Resolved path of the SQLite file the app's engine uses"""
+    with app.app_context():
+        return db.engine.url.database
+
+
+def run_backup(app):
+    """Take a snapshot using the app's BACKUP_* settings"""
+    return backup_database(
+        get_database_file(app),
+        get_backup_dir(app),
+        pages_per_step=app.config['BACKUP_PAGES_PER_STEP'],
+        step_sleep=app.config['BACKUP_STEP_SLEEP'],
+        keep=app.config['BACKUP_KEEP'],
+        max_restarts=app.config['BACKUP_MAX_RESTARTS'],
+    )
+
+
+def _acquire_scheduler_lock(backup_dir):
+    """Take a non-blocking lock file in ``backup_dir``; None if another process has it.
+
+    create_app runs in every process (reloader parent and child, each WSGI
+    worker), and only one of them should schedule backups. The lock is held
+    for the life of the process and released by the OS when it exits.
+    """
+    os.makedirs(backup_dir, exist_ok=True)
+    lock_file = open(os.path.join(backup_dir, SCHEDULER_LOCK), 'w')
+    try:
+        fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        lock_file.close()
+        return None
+    return lock_file
+
+
+def start_backup_scheduler(app):
+    """Run ``run_backup`` every BACKUP_INTERVAL_HOURS in a daemon thread.
+
+    Returns None without starting a thread when another process already
+    runs the scheduler for the same BACKUP_DIR.
+    """
+    lock_file = _acquire_scheduler_lock(get_backup_dir(app))
+    if lock_file is None:
+        app.logger.info('Backup scheduler already running in another process')
+        return None
+    interval = app.config['BACKUP_INTERVAL_HOURS'] * 3600
+
+    def loop():
+        while True:
+            time.sleep(interval)
+            try:
+                report = run_backup(app)
+                app.logger.info('Backup written: %s', report)
+            except Exception:
+                app.logger.exception('Scheduled backup failed')
+
+    thread = threading.Thread(target=loop, name='menudb-backup', daemon=True)
+    thread.lock_file = lock_file
+    thread.start()
+    return thread
@@ -0,0 +1,125 @@
+"""Versioned ingredient/category/genre catalog snapshot.
+
+The catalog only changes when an ingredient, category or genre is written,
+so the whole thing is served as one precompressed JSON document that the
+browser caches and filters locally for autocomplete. A generation counter in
+app_meta is bumped in the same transaction as every catalog write; the
+snapshot is rebuilt only when the stored generation differs.
+
+Snapshot format (arrays keep it compact)::
+
+    {"generation": 3,
+     "categories": [[id, name, display_order], ...],
+     "genres": [[id, name], ...],
+     "ingredients": [[id, name, category_id, display_order], ...]}
+"""
+import gzip
+import hashlib
+import json
+import threading
+
+from flask import current_app
+from sqlalchemy import event
+
+from app import db
+from app.models import AppMeta, DishGenre, Ingredient, IngredientCategory
+
+try:
+    import brotli
+except ImportError:  # optional
+    brotli = None
+
+GENERATION_KEY = 'catalog_generation'
+CATALOG_MODELS = (Ingredient, IngredientCategory, DishGenre)
+_PENDING_KEY = 'catalog_changed'
+
+_build_lock = threading.Lock()
+
+
+class CatalogSnapshot:
+    """One immutable, precompressed catalog document"""
+
+    def __init__(self, generation, body):
+        self.generation = generation
+        self.body = body
+        self.version = hashlib.sha256(body).hexdigest()[:16]
+        self.encoded = {'gzip': gzip.compress(body, compresslevel=9)}
+        if brotli is not None:
+            self.encoded['br'] = brotli.compress(body)
+
+    def encode_for(self, accept_encodings):
+        """Return (content_encoding, payload) for the client's Accept-Encoding"""
+        for encoding in ('br', 'gzip'):
+            if encoding in self.encoded and encoding in accept_encodings:
+                return encoding, self.encoded[encoding]
+        return None, self.body
+
+
+def get_catalog_generation():
+    value = db.session.query(AppMeta.value).filter_by(key=GENERATION_KEY).scalar()
+    return value or 0
+
+
+def build_catalog(generation):
+    categories = IngredientCategory.query.order_by(IngredientCategory.display_order).all()
+    genres = DishGenre.query.order_by(DishGenre.id).all()
+    ingredients = db.session.query(
+        Ingredient.id, Ingredient.name, Ingredient.category_id, Ingredient.display_order
+    ).order_by(Ingredient.category_id, Ingredient.display_order).all()
+
+    data = {
+        'generation': generation,
+        'categories': [[c.id, c.name, c.display_order] for c in categories],
+        'genres': [[g.id, g.name] for g in genres],
+        'ingredients': [list(row) for row in ingredients],
+    }
+    body = json.dumps(data, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+    return CatalogSnapshot(generation, body)
+
+
+def get_catalog_snapshot():
+    """Return the current snapshot, rebuilding it if the generation moved"""
+    generation = get_catalog_generation()
+    snapshot = current_app.extensions.get('menudb_catalog')
+    if snapshot is not None and snapshot.generation == generation:
+        return snapshot
+
+    with _build_lock:
+        snapshot = current_app.extensions.get('menudb_catalog')
+        if snapshot is None or snapshot.generation != generation:
+            snapshot = build_catalog(generation)
+            current_app.extensions['menudb_catalog'] = snapshot
+    return snapshot
+
+
+# =============================================================================
+# Session hooks
+# =============================================================================
+
+@event.listens_for(db.session, 'before_flush')
+def _detect_catalog_change(session, flush_context, instances):
+    changed = any(isinstance(obj, CATALOG_MODELS) for obj in session.new) or \
+        any(isinstance(obj, CATALOG_MODELS) for obj in session.deleted) or \
+        any(isinstance(obj, CATALOG_MODELS) and session.is_modified(obj, include_collections=False)
+            for obj in session.dirty)
+    if changed:
+        session.info[_PENDING_KEY] = True
+
+
+@event.listens_for(db.session, 'after_flush')
+def _bump_catalog_generation(session, flush_context):
+    if not session.info.pop(_PENDING_KEY, False):
+        return
+
+    conn = session.connection()
+    table = AppMeta.__table__
+    result = conn.execute(
+        table.update().where(table.c.key == GENERATION_KEY).values(value=table.c.value + 1)
+    )
+    if result.rowcount == 0:
+        conn.execute(table.insert().values(key=GENERATION_KEY, value=1))
+
+
+@event.listens_for(db.session, 'after_rollback')
+def _discard_pending(session):
+    session.info.pop(_PENDING_KEY, None)
@@ -0,0 +1,212 @@
+"""Append-only change feed for syncing clients and replicas.
+
+Every commit that touches a dish (including its genre/ingredient
+associations) or an ingredient appends change_log entries in the same
+transaction: an ``upsert`` carrying the full row image, or a ``delete``
+tombstone. Consumers poll /api/changes?since=<seq> and apply entries in seq
+order.
+
+Compaction drops entries superseded by a later one for the same entity,
+which never loses information for any consumer, and drops tombstones older
+than the retention period. The highest dropped tombstone seq becomes the
+feed floor; consumers whose cursor is below it must resync from scratch.
+
+A resync starts from since=0 with empty local state, so it does not need
+the dropped tombstones. Its cursors are below the floor until it catches up,
+so it sends back the ``floor`` of its first batch with every request; the
+cursor is accepted while that floor is still current. If another compaction
+moves the floor mid-resync, the request gets 410 again and the resync
+restarts.
+"""
+import json
+from datetime import datetime, timedelta
+
+from sqlalchemy import event, func
+
+from app import db
+from app.models import (AppMeta, ChangeLog, Dish, Ingredient,
+                        dish_genre_relations, dish_ingredient_relations)
+
+FLOOR_KEY = 'change_log_floor'
+CHUNK_SIZE = 500
+_PENDING_KEY = 'change_log_pending'
+
+
+def get_change_log_floor():
+    value = db.session.query(AppMeta.value).filter_by(key=FLOOR_KEY).scalar()
+    return value or 0
+
+
+def _dish_images(conn, dish_ids):
+    images = {}
+    for row in conn.execute(
+        db.select(Dish.id, Dish.name, Dish.difficulty, Dish.memo, Dish.created_at, Dish.updated_at)
+        .where(Dish.id.in_(dish_ids))
+    ):
+        images[row.id] = {
+            'id': row.id,
+            'name': row.name,
+            'difficulty': row.difficulty,
+            'memo': row.memo,
+            'created_at': row.created_at.isoformat() if row.created_at else None,
+            'updated_at': row.updated_at.isoformat() if row.updated_at else None,
+            'genre_ids': [],
+            'ingredient_ids': [],
+        }
+
+    for dish_id, genre_id in conn.execute(
+        db.select(dish_genre_relations.c.dish_id, dish_genre_relations.c.genre_id)
+        .where(dish_genre_relations.c.dish_id.in_(dish_ids))
+        .order_by(dish_genre_relations.c.dish_id, dish_genre_relations.c.genre_id)
+    ):
+        if dish_id in images:
+            images[dish_id]['genre_ids'].append(genre_id)
+
+    for dish_id, ingredient_id in conn.execute(
+        db.select(dish_ingredient_relations.c.dish_id, dish_ingredient_relations.c.ingredient_id)
+        .where(dish_ingredient_relations.c.dish_id.in_(dish_ids))
+        .order_by(dish_ingredient_relations.c.dish_id, dish_ingredient_relations.c.ingredient_id)
+    ):
+        if dish_id in images:
+            images[dish_id]['ingredient_ids'].append(ingredient_id)
+    return images
+
+
+def _ingredient_images(conn, ingredient_ids):
+    return {
+        row.id: dict(row._mapping)
+        for row in conn.execute(
+            db.select(Ingredient.id, Ingredient.name, Ingredient.category_id, Ingredient.display_order)
+            .where(Ingredient.id.in_(ingredient_ids))
+        )
+    }
+
+
+def append_changes(conn, entity, upsert_ids=(), delete_ids=()):
+    """Append upserts (with current row images) and tombstones for one entity type"""
+    now = datetime.utcnow()
+    entries = [
+        {'entity': entity, 'entity_id': i, 'op': 'delete', 'data': None, 'created_at': now}
+        for i in sorted(set(delete_ids))
+    ]
+
+    upsert_ids = sorted(set(upsert_ids) - set(delete_ids))
+    build = _dish_images if entity == 'dish' else _ingredient_images
+    for i in range(0, len(upsert_ids), CHUNK_SIZE):
+        images = build(conn, upsert_ids[i:i + CHUNK_SIZE])
+        entries.extend(
+            {'entity': entity, 'entity_id': entity_id, 'op': 'upsert',
+             'data': json.dumps(image, ensure_ascii=False), 'created_at': now}
+            for entity_id, image in images.items()
+        )
+
+    if entries:
+        conn.execute(ChangeLog.__table__.insert(), entries)
+
+
+def seed_change_log(conn):
+    """Record an upsert for every existing dish and ingredient"""
+    append_changes(conn, 'ingredient', conn.execute(db.select(Ingredient.id)).scalars().all())
+    append_changes(conn, 'dish', conn.execute(db.select(Dish.id)).scalars().all())
+
+
+def compact_change_log(conn, retention_days):
+    """Drop superseded entries and expired tombstones.
+
+    Returns (number of entries removed, new floor).
+    """
+    table = ChangeLog.__table__
+    latest = db.select(func.max(table.c.seq)).group_by(table.c.entity, table.c.entity_id)
+    removed = conn.execute(table.delete().where(table.c.seq.not_in(latest))).rowcount
+
+    cutoff = datetime.utcnow() - timedelta(days=retention_days)
+    expired = (table.c.op == 'delete') & (table.c.created_at < cutoff)
+    expired_max = conn.execute(db.select(func.max(table.c.seq)).where(expired)).scalar()
+
+    floor = conn.execute(
+        db.select(AppMeta.value).where(AppMeta.key == FLOOR_KEY)
+    ).scalar() or 0
+    if expired_max is not None:
+        removed += conn.execute(table.delete().where(expired)).rowcount
+        meta = AppMeta.__table__
+        if floor:
+            conn.execute(meta.update().where(meta.c.key == FLOOR_KEY).values(value=expired_max))
+        else:
+            conn.execute(meta.insert().values(key=FLOOR_KEY, value=expired_max))
+        floor = expired_max
+    return removed, floor
+
+
+# =============================================================================
+# Session hooks
+# =============================================================================
+
+def _pending(session):
+    return session.info.setdefault(_PENDING_KEY, {
+        'dishes': set(), 'ingredients': set(),
+        'dish_ids': set(), 'ingredient_ids': set(),
+        'deleted_dish_ids': set(), 'deleted_ingredient_ids': set(),
+    })
+
+
+@event.listens_for(db.session, 'before_flush')
+def _collect_changes(session, flush_context, instances):
+    """Remember which dishes/ingredients the pending flush writes or deletes"""
+    pending = _pending(session)
+
+    for obj in list(session.new) + list(session.dirty):
+        if isinstance(obj, Dish):
+            pending['dishes'].add(obj)
+        elif isinstance(obj, Ingredient) and (
+            obj in session.new or session.is_modified(obj, include_collections=False)
+        ):
+            pending['ingredients'].add(obj)
+
+    deleted_ingredient_ids = set()
+    for obj in session.deleted:
+        if isinstance(obj, Dish) and obj.id is not None:
+            pending['deleted_dish_ids'].add(obj.id)
+        elif isinstance(obj, Ingredient) and obj.id is not None:
+            deleted_ingredient_ids.add(obj.id)
+
+    # Deleting an ingredient also changes the associations of its dishes
+    if deleted_ingredient_ids:
+        pending['deleted_ingredient_ids'].update(deleted_ingredient_ids)
+        pending['dish_ids'].update(session.connection().execute(
+            db.select(dish_ingredient_relations.c.dish_id)
+            .where(dish_ingredient_relations.c.ingredient_id.in_(deleted_ingredient_ids))
+        ).scalars())
+
+
+@event.listens_for(db.session, 'after_flush')
+def _resolve_ids(session, flush_context):
+    """New rows have their ids once flushed"""
+    pending = session.info.get(_PENDING_KEY)
+    if not pending:
+        return
+    pending['dish_ids'].update(d.id for d in pending['dishes'] if d.id is not None)
+    pending['ingredient_ids'].update(i.id for i in pending['ingredients'] if i.id is not None)
+    pending['dishes'].clear()
+    pending['ingredients'].clear()
+
+
+@event.listens_for(db.session, 'before_commit')
+def _append_changes(session):
+    """Append one entry per changed entity, in the committing transaction.
+
+    A write transaction usually flushes several times (autoflush), so
+    entries are written once at commit rather than after every flush.
+    """
+    session.flush()
+    pending = session.info.pop(_PENDING_KEY, None)
+    if not pending:
+        return
+
+    conn = session.connection()
+    append_changes(conn, 'ingredient', pending['ingredient_ids'], pending['deleted_ingredient_ids'])
+    append_changes(conn, 'dish', pending['dish_ids'], pending['deleted_dish_ids'])
+
+
+@event.listens_for(db.session, 'after_rollback')
+def _discard_pending(session):
+    session.info.pop(_PENDING_KEY, None)
@@ -0,0 +1,72 @@
+import click
+from flask import current_app
+from flask.cli import AppGroup
+
+from app import db
+
+menudb_cli = AppGroup('menudb', help='MenuDB maintenance commands.')
+
+
+@menudb_cli.command('check-summaries')
+@click.option('--fix', is_flag=True, help='Rebuild the summaries of inconsistent dishes.')
+def check_summaries(fix):
+    """Check dish_summaries against the dish/genre/ingredient tables."""
+    from app.summaries import check_dish_summaries, refresh_dish_summaries
+
+    with db.engine.begin() as conn:
+        result = check_dish_summaries(conn)
+        problems = result['missing'] + result['stale'] + result['orphaned']
+
+        for kind, ids in result.items():
+            click.echo(f'{kind}: {len(ids)}' + (f' {ids[:20]}' if ids else ''))
+
+        if problems and fix:
+            refresh_dish_summaries(conn, problems)
+            click.echo(f'Rebuilt {len(problems)} summaries.')
+
+    if problems and not fix:
+        raise SystemExit(1)
+
+
+@menudb_cli.command('rebuild-summaries')
+def rebuild_summaries():
+    """Rebuild dish_summaries from scratch."""
+    from app.summaries import rebuild_dish_summaries
+
+    with db.engine.begin() as conn:
+        count = rebuild_dish_summaries(conn)
+    click.echo(f'Rebuilt summaries for {count} dishes.')
+
+
+@menudb_cli.command('compact-changes')
+@click.option('--retention-days', type=int, default=None,
+              help='Keep tombstones newer than this (default: CHANGE_LOG_RETENTION_DAYS).')
+def compact_changes(retention_days):
+    """Drop superseded change feed entries and expired tombstones."""
+    from app.changes import compact_change_log
+
+    if retention_days is None:
+        retention_days = current_app.config['CHANGE_LOG_RETENTION_DAYS']
+
+    with db.engine.begin() as conn:
+        removed, floor = compact_change_log(conn, retention_days)
+    click.echo(f'Removed {removed} entries (floor: {floor}).')
+
+
+@menudb_cli.command('backup')
+@click.option('--dest', default=None, help='Backup directory (default: BACKUP_DIR).')
+@click.option('--keep', type=int, default=None, help='Number of snapshots to keep.')
+def backup(dest, keep):
+    """Take an online snapshot of the database."""
+    from app.backup import backup_database, get_backup_dir, get_database_file
+
+    report = backup_database(
+        get_database_file(current_app),
+        dest or get_backup_dir(current_app),
+        pages_per_step=current_app.config['BACKUP_PAGES_PER_STEP'],
+        step_sleep=current_app.config['BACKUP_STEP_SLEEP'],
+        keep=current_app.config['BACKUP_KEEP'] if keep is None else keep,
+        max_restarts=current_app.config['BACKUP_MAX_RESTARTS'],
+    )
+    for key, value in report.items():
+        click.echo(f'{key}: {value}')
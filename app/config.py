@@ -8,6 +8,7 @@ class Config:
     DATABASE_PATH = os.environ.get('DATABASE_PATH', 'data/menudb.db')
     SQLALCHEMY_DATABASE_URI = f'sqlite:///{DATABASE_PATH}'
     SQLALCHEMY_TRACK_MODIFICATIONS = False
+    SQLITE_BUSY_TIMEOUT = 5000  # ms to wait for another process' write lock
 
     # WTF
     WTF_CSRF_ENABLED = True
@@ -15,9 +16,22 @@ class Config:
 
     # App settings
     ITEMS_PER_PAGE = 10
+    MAX_ITEMS_PER_PAGE = 100
+    STREAM_CHUNK_SIZE = 200  # rows fetched per chunk when streaming pages
+    STREAM_BUFFER_SIZE = 256  # template fragments per streamed chunk
     MAX_GENRES_PER_DISH = 2
     MAX_INGREDIENTS_PER_DISH = 10
     MAX_MEMO_LENGTH = 500
+    CHANGE_FEED_BATCH_SIZE = 500
+    CHANGE_LOG_RETENTION_DAYS = 30
+
+    # Backups (BACKUP_DIR defaults to <database dir>/backups)
+    BACKUP_DIR = os.environ.get('BACKUP_DIR')
+    BACKUP_INTERVAL_HOURS = float(os.environ.get('BACKUP_INTERVAL_HOURS', 0))  # 0 = disabled
+    BACKUP_KEEP = 7
+    BACKUP_PAGES_PER_STEP = 256
+    BACKUP_STEP_SLEEP = 0.01  # seconds between backup steps
+    BACKUP_MAX_RESTARTS = 3  # stepped-copy restarts before copying in one step
 
 
 class DevelopmentConfig(Config):
@@ -0,0 +1,361 @@
+"""In-memory dish index for search and facet counts.
+
+Each process keeps an inverted index of dish ids per ingredient, the dishes
+grouped by their exact set of genres ("genre combination"; a dish has at
+most a couple of genres, so there are only a few dozen of them) with an
+ingredient counter per combination, and every dish's sort key (updated_at,
+id). A genre filter is then a union of whole combinations, so its size and
+its ingredient counts are sums over a few dozen entries rather than set
+operations over tens of thousands of ids, and the remaining facet counts
+are read off the few ingredient postings a search touches.
+
+Postings and the global order are sorted ``array('q')`` rather than sets or
+lists: the cyclic garbage collector does not walk arrays, whereas several
+hundred thousand set entries made every full collection cost over 100 ms.
+Only ingredient postings, which are short, are turned into sets on the fly.
+
+The index follows the change feed: it remembers the change_log seq it
+reflects and, on each use, replays the dish entries committed since then.
+A full load is needed when there is no index yet, when compaction dropped
+tombstones it has not seen, or when the backlog is too long to replay. Loads
+run in a background thread (started with the app and whenever a reload is
+needed) and the new index replaces the old one once it is complete; until
+then searches run in SQL, which gives the same results more slowly.
+
+Facet counts are disjunctive, i.e. each one answers "how many dishes would
+I see if I selected this too", so they ignore the filter they belong to
+when that filter is an OR:
+
+- genre counts: dishes matching the ingredient filter that have the genre
+  (genres are always OR'ed, so the genre filter itself is ignored)
+- ingredient counts, fuzzy mode (OR): dishes matching the genre filter that
+  contain the ingredient (the ingredient filter is ignored)
+- ingredient counts, exact mode (AND): matched dishes that also contain
+  the ingredient, which is what adding it to the filter would leave
+"""
+import bisect
+import json
+import threading
+from array import array
+from collections import Counter, defaultdict
+from datetime import datetime
+from itertools import chain, islice
+
+from flask import current_app
+from sqlalchemy import func
+
+from app import db
+from app.changes import FLOOR_KEY
+from app.models import (AppMeta, ChangeLog, Dish, DishGenre, Ingredient,
+                        dish_genre_relations, dish_ingredient_relations)
+
+# Beyond this many change_log entries a full reload is cheaper than a replay
+REPLAY_LIMIT = 5000
+# Matches up to this size are sorted directly; larger ones walk the global order
+SORT_LIMIT = 2000
+LOAD_CHUNK_SIZE = 10000
+
+INDEX_KEY = 'menudb_dish_index'
+BUILD_KEY = 'menudb_dish_index_build'
+
+_build_lock = threading.Lock()
+
+
+def _ids():
+    return array('q')
+
+
+def _combo(genre_ids):
+    """Key of a dish's genre combination"""
+    return tuple(sorted(set(genre_ids)))
+
+
+def _insert(ids, dish_id, key=None):
+    ids.insert(bisect.bisect(ids, key(dish_id) if key else dish_id, key=key), dish_id)
+
+
+def _delete(ids, dish_id, key=None):
+    position = bisect.bisect_left(ids, key(dish_id) if key else dish_id, key=key)
+    if position < len(ids) and ids[position] == dish_id:
+        del ids[position]
+
+
+def _rows(conn, statement):
+    """Iterate a large result in fetchmany() batches"""
+    return chain.from_iterable(conn.execute(statement).partitions(LOAD_CHUNK_SIZE))
+
+
+def _head(conn):
+    """(feed floor, highest seq ever assigned).
+
+    Compaction can drop the newest entries when they are expired tombstones,
+    but the floor is then moved up to them, so max(max seq, floor) never
+    goes back.
+    """
+    floor = conn.execute(db.select(AppMeta.value).where(AppMeta.key == FLOOR_KEY)).scalar() or 0
+    seq = conn.execute(db.select(func.max(ChangeLog.seq))).scalar() or 0
+    return floor, max(seq, floor)
+
+
+class DishIndex:
+    """Inverted index of dish ids by genre combination and by ingredient"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.seq = None  # change_log seq the index reflects
+        self.sort_keys = {}  # dish id -> (updated_at, id)
+        self.order = _ids()  # dish ids by sort key, ascending
+        self.dish_genres = {}  # dish id -> tuple of genre ids
+        self.dish_ingredients = {}  # dish id -> tuple of ingredient ids
+        self.combo_dishes = defaultdict(_ids)  # genre combination -> sorted dish ids
+        self.combo_ingredient_counts = defaultdict(Counter)  # genre combination -> ingredient counts
+        self.ingredient_dishes = defaultdict(_ids)  # ingredient id -> sorted dish ids
+
+    # -- maintenance ---------------------------------------------------------
+
+    def _add(self, dish_id, updated_at, genre_ids, ingredient_ids):
+        self._remove(dish_id)
+        self.sort_keys[dish_id] = (updated_at or datetime.min, dish_id)
+        _insert(self.order, dish_id, self.sort_keys.__getitem__)
+        self.dish_genres[dish_id] = genre_ids = tuple(genre_ids)
+        self.dish_ingredients[dish_id] = ingredient_ids = tuple(ingredient_ids)
+        combo = _combo(genre_ids)
+        _insert(self.combo_dishes[combo], dish_id)
+        self.combo_ingredient_counts[combo].update(ingredient_ids)
+        for ingredient_id in ingredient_ids:
+            _insert(self.ingredient_dishes[ingredient_id], dish_id)
+
+    def _remove(self, dish_id):
+        if dish_id not in self.sort_keys:
+            return
+        _delete(self.order, dish_id, self.sort_keys.__getitem__)
+        del self.sort_keys[dish_id]
+        combo = _combo(self.dish_genres.pop(dish_id))
+        ingredient_ids = self.dish_ingredients.pop(dish_id)
+        _delete(self.combo_dishes[combo], dish_id)
+        self.combo_ingredient_counts[combo].subtract(ingredient_ids)
+        for ingredient_id in ingredient_ids:
+            _delete(self.ingredient_dishes[ingredient_id], dish_id)
+
+    def load(self, conn, seq):
+        """Fill an empty index from the tables (in the caller's read transaction)"""
+        genres = defaultdict(list)
+        for dish_id, genre_id in _rows(conn, db.select(
+            dish_genre_relations.c.dish_id, dish_genre_relations.c.genre_id
+        )):
+            genres[dish_id].append(genre_id)
+        ingredients, ingredient_dishes = defaultdict(list), defaultdict(list)
+        for dish_id, ingredient_id in _rows(conn, db.select(
+            dish_ingredient_relations.c.dish_id, dish_ingredient_relations.c.ingredient_id
+        )):
+            ingredients[dish_id].append(ingredient_id)
+            ingredient_dishes[ingredient_id].append(dish_id)
+        for ingredient_id, dish_ids in ingredient_dishes.items():
+            self.ingredient_dishes[ingredient_id] = array('q', sorted(dish_ids))
+
+        combo_dishes = defaultdict(list)
+        for dish_id, updated_at in _rows(conn, db.select(Dish.id, Dish.updated_at)):
+            self.sort_keys[dish_id] = (updated_at or datetime.min, dish_id)
+            self.dish_genres[dish_id] = genre_ids = tuple(genres.get(dish_id, ()))
+            self.dish_ingredients[dish_id] = tuple(ingredients.get(dish_id, ()))
+            combo_dishes[_combo(genre_ids)].append(dish_id)
+        for combo, dish_ids in combo_dishes.items():
+            self.combo_dishes[combo] = array('q', sorted(dish_ids))
+            self.combo_ingredient_counts[combo] = self._count(self.dish_ingredients, dish_ids)
+        self.order = array('q', sorted(self.sort_keys, key=self.sort_keys.__getitem__))
+        self.seq = seq
+
+    def replay(self, session, seq):
+        """Apply the dish entries of change_log after ``self.seq``"""
+        for op, entity_id, data in session.execute(
+            db.select(ChangeLog.op, ChangeLog.entity_id, ChangeLog.data)
+            .where(ChangeLog.seq > self.seq, ChangeLog.seq <= seq, ChangeLog.entity == 'dish')
+            .order_by(ChangeLog.seq)
+        ):
+            if op == 'delete':
+                self._remove(entity_id)
+                continue
+            image = json.loads(data)
+            updated_at = image['updated_at'] and datetime.fromisoformat(image['updated_at'])
+            self._add(entity_id, updated_at, image['genre_ids'], image['ingredient_ids'])
+        self.seq = seq
+
+    def sync(self, session):
+        """Catch up with the change feed; must hold ``self.lock``.
+
+        Returns False, leaving the index as it is, when a replay cannot
+        catch it up and it has to be loaded again.
+        """
+        floor, seq = _head(session)
+        if seq == self.seq:
+            return True
+        if floor > self.seq or seq < self.seq or seq - self.seq > REPLAY_LIMIT:
+            return False
+        self.replay(session, seq)
+        return True
+
+    # -- queries -------------------------------------------------------------
+
+    @staticmethod
+    def _count(values, dish_ids):
+        """Count the values (genres or ingredients) of the given dishes"""
+        return Counter(chain.from_iterable(map(values.__getitem__, dish_ids)))
+
+    def _walk(self, contains, offset, limit):
+        """One page of the dishes passing ``contains``, walking the global order"""
+        return list(islice(filter(contains, reversed(self.order)), offset, offset + limit))
+
+    def _page(self, matched, offset, limit):
+        """Dish ids of one page of ``matched``, newest first"""
+        if len(matched) <= SORT_LIMIT:
+            ordered = sorted(matched, key=self.sort_keys.__getitem__, reverse=True)
+            return ordered[offset:offset + limit]
+        # Dense matches: walk the global order until the page is full
+        return self._walk(matched.__contains__, offset, limit)
+
+    def search(self, genre_ids, ingredient_ids, mode, offset, limit):
+        """Match dishes and count facets; must hold ``self.lock``.
+
+        Returns (page of dish ids newest first, total matched, genre counts,
+        ingredient counts). With no filter the page is None: listing every
+        dish is left to the dish_summaries query, which has an index on
+        updated_at.
+        """
+        selected_genres = frozenset(genre_ids)
+        ingredient_ids = list(dict.fromkeys(ingredient_ids))
+        exact = mode == 'exact'
+
+        def has_genre(dish_id):
+            return not selected_genres.isdisjoint(self.dish_genres[dish_id])
+
+        # Genre combinations with any of the selected genres
+        combos = [combo for combo, dish_ids in self.combo_dishes.items()
+                  if dish_ids and not selected_genres.isdisjoint(combo)]
+
+        # None stands for "every dish"
+        matched = None
+        if ingredient_ids:
+            postings = [self.ingredient_dishes.get(i, ()) for i in ingredient_ids]
+            if exact:
+                postings.sort(key=len)
+                by_ingredient = set(postings[0]).intersection(*postings[1:])
+            else:
+                by_ingredient = set().union(*postings)
+            matched = set(filter(has_genre, by_ingredient)) if selected_genres else by_ingredient
+
+        # Genre counts ignore the genre filter
+        if ingredient_ids:
+            genre_counts = self._count(self.dish_genres, by_ingredient)
+        else:
+            genre_counts = Counter()
+            for combo, dish_ids in self.combo_dishes.items():
+                for genre_id in combo:
+                    genre_counts[genre_id] += len(dish_ids)
+
+        # Ingredient counts ignore the ingredient filter unless it is an AND
+        if exact and ingredient_ids:
+            ingredient_counts = self._count(self.dish_ingredients, matched)
+        elif selected_genres:
+            ingredient_counts = Counter()
+            for combo in combos:
+                ingredient_counts.update(self.combo_ingredient_counts[combo])
+        else:
+            ingredient_counts = {key: len(ids) for key, ids in self.ingredient_dishes.items()}
+
+        genre_counts = {k: v for k, v in genre_counts.items() if v > 0}
+        ingredient_counts = {k: v for k, v in ingredient_counts.items() if v > 0}
+        if matched is not None:
+            return self._page(matched, offset, limit), len(matched), genre_counts, ingredient_counts
+        if not selected_genres:
+            return None, len(self.sort_keys), genre_counts, ingredient_counts
+
+        # Genres only: the match is a union of whole combinations
+        total = sum(len(self.combo_dishes[combo]) for combo in combos)
+        if total <= SORT_LIMIT:
+            page = self._page(set().union(*(self.combo_dishes[c] for c in combos)), offset, limit)
+        else:
+            page = self._walk(has_genre, offset, limit)
+        return page, total, genre_counts, ingredient_counts
+
+
+def search_sql(genre_ids, ingredient_ids, mode, offset, limit):
+    """``DishIndex.search`` in SQL, used while the index is being loaded"""
+    def dish_query(genres, ingredients):
+        query = Dish.query.with_entities(Dish.id)
+        if genres:
+            query = query.filter(Dish.genres.any(DishGenre.id.in_(genres)))
+        if ingredients and mode == 'exact':
+            for ingredient_id in ingredients:
+                query = query.filter(Dish.ingredients.any(Ingredient.id == ingredient_id))
+        elif ingredients:
+            query = query.filter(Dish.ingredients.any(Ingredient.id.in_(ingredients)))
+        return query
+
+    def counts(table, column, query):
+        return dict(
+            db.session.query(column, func.count())
+            .filter(table.c.dish_id.in_(query))
+            .group_by(column)
+            .all()
+        )
+
+    matched = dish_query(genre_ids, ingredient_ids)
+    genre_counts = counts(dish_genre_relations, dish_genre_relations.c.genre_id,
+                          dish_query([], ingredient_ids))
+    ingredient_counts = counts(
+        dish_ingredient_relations, dish_ingredient_relations.c.ingredient_id,
+        matched if mode == 'exact' and ingredient_ids else dish_query(genre_ids, [])
+    )
+    if not genre_ids and not ingredient_ids:
+        return None, matched.count(), genre_counts, ingredient_counts
+    page = [dish_id for dish_id, in matched.order_by(Dish.updated_at.desc(), Dish.id.desc())
+            .offset(offset).limit(limit)]
+    return page, matched.count(), genre_counts, ingredient_counts
+
+
+def build_dish_index(app):
+    """Load a new DishIndex from the tables and install it for ``app``"""
+    index = DishIndex()
+    # One read transaction, so the tables are read as of the seq
+    with app.app_context(), db.engine.connect() as conn, conn.begin():
+        index.load(conn, _head(conn)[1])
+    app.extensions[INDEX_KEY] = index
+    return index
+
+
+def start_dish_index_build(app):
+    """Run ``build_dish_index`` in a daemon thread unless one is running; returns the thread"""
+    def build():
+        try:
+            build_dish_index(app)
+        except Exception:
+            app.logger.exception('Dish index build failed')
+
+    with _build_lock:
+        thread = app.extensions.get(BUILD_KEY)
+        if thread is None or not thread.is_alive():
+            thread = threading.Thread(target=build, name='menudb-dish-index', daemon=True)
+            app.extensions[BUILD_KEY] = thread
+            thread.start()
+        return thread
+
+
+def get_dish_index():
+    """This app's DishIndex, or None until the first build has finished"""
+    return current_app.extensions.get(INDEX_KEY)
+
+
+def search_index(genre_ids, ingredient_ids, mode, offset, limit):
+    """``DishIndex.search`` on this app's index, synced first.
+
+    While there is no index, or it needs a full reload, a build is started
+    in the background and the search runs in ``search_sql`` meanwhile, so no
+    request waits for a load.
+    """
+    index = get_dish_index()
+    if index is not None:
+        with index.lock:
+            if index.sync(db.session):
+                return index.search(genre_ids, ingredient_ids, mode, offset, limit)
+    start_dish_index_build(current_app._get_current_object())
+    return search_sql(genre_ids, ingredient_ids, mode, offset, limit)
@@ -1,3 +1,4 @@
+import json
 from datetime import datetime
 from app import db
 
@@ -75,9 +76,12 @@ class Dish(db.Model):
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
 
     # Relationships
+    # Association rowid keeps the order in which genres/ingredients were chosen
     genres = db.relationship('DishGenre', secondary=dish_genre_relations,
+                             order_by=db.literal_column('dish_genre_relations.rowid'),
                              backref=db.backref('dishes', lazy='dynamic'))
     ingredients = db.relationship('Ingredient', secondary=dish_ingredient_relations,
+                                  order_by=db.literal_column('dish_ingredient_relations.rowid'),
                                   backref=db.backref('dishes', lazy='dynamic'))
 
     __table_args__ = (
@@ -104,3 +108,68 @@ class Dish(db.Model):
             'genres': [{'id': g.id, 'name': g.name} for g in self.genres],
             'ingredients': [{'id': i.id, 'name': i.name} for i in self.ingredients]
         }
+
+
+class DishSummary(db.Model):
+    """Pre-joined dish card data for list pages (maintained by app.summaries)"""
+    __tablename__ = 'dish_summaries'
+
+    id = db.Column(db.Integer, db.ForeignKey('dishes.id', ondelete='CASCADE'), primary_key=True)
+    name = db.Column(db.String(100), nullable=False)
+    difficulty = db.Column(db.Integer, nullable=False)
+    updated_at = db.Column(db.DateTime, index=True)
+    genre_names = db.Column(db.Text, nullable=False, default='')
+    ingredient_names = db.Column(db.Text, nullable=False, default='')
+    ingredient_count = db.Column(db.Integer, nullable=False, default=0)
+    ingredient_ids_packed = db.Column(db.Text, nullable=False, default='')
+
+    def __repr__(self):
+        return f'<DishSummary {self.name}>'
+
+    @property
+    def genre_name_list(self):
+        return self.genre_names.split('、') if self.genre_names else []
+
+    @property
+    def ingredient_ids(self):
+        return [int(x) for x in self.ingredient_ids_packed.split(',') if x]
+
+
+class AppMeta(db.Model):
+    """Integer application counters (e.g. catalog generation)"""
+    __tablename__ = 'app_meta'
+
+    key = db.Column(db.String(50), primary_key=True)
+    value = db.Column(db.Integer, nullable=False, default=0)
+
+    def __repr__(self):
+        return f'<AppMeta {self.key}={self.value}>'
+
+
+class ChangeLog(db.Model):
+    """Append-only change feed entry (maintained by app.changes)"""
+    __tablename__ = 'change_log'
+
+    seq = db.Column(db.Integer, primary_key=True, autoincrement=True)
+    entity = db.Column(db.String(20), nullable=False)
+    entity_id = db.Column(db.Integer, nullable=False)
+    op = db.Column(db.String(10), nullable=False)  # upsert or delete
+    data = db.Column(db.Text, nullable=True)  # JSON row image, NULL for tombstones
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
+    __table_args__ = (
+        db.Index('ix_change_log_entity', 'entity', 'entity_id', 'seq'),
+        {'sqlite_autoincrement': True},
+    )
+
+    def __repr__(self):
+        return f'<ChangeLog {self.seq} {self.op} {self.entity}:{self.entity_id}>'
+
+    def to_dict(self):
+        return {
+            'seq': self.seq,
+            'entity': self.entity,
+            'id': self.entity_id,
+            'op': self.op,
+            'data': json.loads(self.data) if self.data is not None else None
+        }
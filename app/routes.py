@@ -1,8 +1,14 @@
-from flask import Blueprint, render_template, request, redirect, url_for, flash, jsonify, current_app
+from flask import Blueprint, render_template, stream_with_context, request, redirect, url_for, flash, jsonify, current_app, get_flashed_messages
+from flask_sqlalchemy.pagination import Pagination, QueryPagination
+from flask_wtf.csrf import generate_csrf
 from sqlalchemy import func
 from app import db, csrf
-from app.models import Dish, Ingredient, IngredientCategory, DishGenre
+from app.models import ChangeLog, Dish, DishSummary, Ingredient, IngredientCategory, DishGenre
 from app.forms import DishForm, IngredientForm, SearchForm, DeleteIngredientForm
+from app.writer import serialized_write, WriteConflict
+from app.catalog import get_catalog_snapshot
+from app.changes import get_change_log_floor
+from app.facets import search_index
 
 main_bp = Blueprint('main', __name__)
 
@@ -13,6 +19,15 @@ def get_ingredients_by_category():
     return categories
 
 
+def iter_ingredient_groups(categories):
+    """Yield (category, ingredients) with each category's ingredients fetched in chunks"""
+    chunk_size = current_app.config['STREAM_CHUNK_SIZE']
+    for category in categories:
+        yield category, Ingredient.query.filter_by(category_id=category.id).order_by(
+            Ingredient.display_order
+        ).yield_per(chunk_size)
+
+
 def get_all_genres():
     """Get all genres"""
     return DishGenre.query.all()
@@ -23,6 +38,69 @@ def get_all_ingredients():
     return Ingredient.query.order_by(Ingredient.category_id, Ingredient.display_order).all()
 
 
+def get_per_page():
+    """per_page query argument clamped to 1..MAX_ITEMS_PER_PAGE"""
+    per_page = request.args.get('per_page', current_app.config['ITEMS_PER_PAGE'], type=int)
+    return max(1, min(per_page, current_app.config['MAX_ITEMS_PER_PAGE']))
+
+
+class StreamedPagination(QueryPagination):
+    """Pagination whose items are fetched in chunks while the page streams"""
+
+    def _query_items(self):
+        query = self._query_args['query']
+        return query.limit(self.per_page).offset(self._query_offset).yield_per(
+            current_app.config['STREAM_CHUNK_SIZE']
+        )
+
+
+class PrefetchedPagination(Pagination):
+    """Pagination over a page of items and a total computed up front"""
+
+    def _query_items(self):
+        return self._query_args['items']
+
+    def _query_count(self):
+        return self._query_args['total']
+
+
+def stream_page(template, **context):
+    """Stream a template as it renders.
+
+    Headers (and the session cookie) are sent before the body, so anything
+    that touches the session - flashed messages, the CSRF token - is
+    resolved here first. Jinja yields every text fragment and expression
+    separately, so the stream is buffered into chunks of
+    STREAM_BUFFER_SIZE fragments (a few KB) rather than tens of thousands
+    of tiny writes.
+    """
+    get_flashed_messages(with_categories=True)
+    generate_csrf()
+
+    app = current_app._get_current_object()
+    app.update_template_context(context)
+    stream = app.jinja_env.get_template(template).stream(context)
+    stream.enable_buffering(app.config['STREAM_BUFFER_SIZE'])
+    return stream_with_context(stream)
+
+
+def create_ingredient(name, category_id):
+    """Add an ingredient at the end of its category.
+
+    display_order is computed by a subquery inside the INSERT itself, so two
+    concurrent creations can never read the same MAX(display_order).
+    Must be called inside ``serialized_write()``.
+    """
+    next_order = db.select(
+        func.coalesce(func.max(Ingredient.display_order), 0) + 1
+    ).where(Ingredient.category_id == category_id).scalar_subquery()
+
+    ingredient = Ingredient(name=name, category_id=category_id, display_order=next_order)
+    db.session.add(ingredient)
+    db.session.flush()
+    return ingredient
+
+
 # =============================================================================
 # Search Pages
 # =============================================================================
@@ -44,18 +122,20 @@ def edit_mode():
     categories = get_ingredients_by_category()
     genres = get_all_genres()
 
-    # Get all dishes with pagination
+    # Get all dishes with pagination (rows are streamed, not loaded up front)
     page = request.args.get('page', 1, type=int)
-    per_page = request.args.get('per_page', current_app.config['ITEMS_PER_PAGE'], type=int)
-    dishes = Dish.query.order_by(Dish.updated_at.desc()).paginate(
-        page=page, per_page=per_page, error_out=False
+    dishes = StreamedPagination(
+        query=DishSummary.query.order_by(DishSummary.updated_at.desc()),
+        page=page, per_page=get_per_page(),
+        max_per_page=current_app.config['MAX_ITEMS_PER_PAGE'], error_out=False
     )
 
-    return render_template('edit_mode.html',
-                           categories=categories,
-                           genres=genres,
-                           dishes=dishes,
-                           mode='edit')
+    return stream_page('edit_mode.html',
+                       categories=categories,
+                       ingredient_groups=iter_ingredient_groups(categories),
+                       genres=genres,
+                       dishes=dishes,
+                       mode='edit')
 
 
 @main_bp.route('/search')
@@ -66,38 +146,34 @@ def search_dishes():
     genre_ids_str = request.args.get('genre_ids', '')
     mode = request.args.get('mode', 'fuzzy')
     page = request.args.get('page', 1, type=int)
-    per_page = request.args.get('per_page', current_app.config['ITEMS_PER_PAGE'], type=int)
+    per_page = get_per_page()
     view_mode = request.args.get('view_mode', 'search')  # search or edit
 
     ingredient_ids = [int(x) for x in ingredient_ids_str.split(',') if x.strip().isdigit()]
     genre_ids = [int(x) for x in genre_ids_str.split(',') if x.strip().isdigit()]
 
-    # Build query
-    query = Dish.query
-
-    # Filter by genres
-    if genre_ids:
-        query = query.filter(Dish.genres.any(DishGenre.id.in_(genre_ids)))
-
-    # Filter by ingredients
-    if ingredient_ids:
-        if mode == 'exact':
-            # Exact match: dish must have ALL specified ingredients
-            for ing_id in ingredient_ids:
-                query = query.filter(Dish.ingredients.any(Ingredient.id == ing_id))
-        else:
-            # Fuzzy match: dish must have ANY of specified ingredients
-            query = query.filter(Dish.ingredients.any(Ingredient.id.in_(ingredient_ids)))
+    # Matching and facet counts come from the in-memory dish index
+    page = max(page, 1)
+    page_ids, total, genre_counts, ingredient_counts = search_index(
+        genre_ids, ingredient_ids, 'exact' if mode == 'exact' else 'fuzzy',
+        (page - 1) * per_page, per_page
+    )
 
-    # Order by relevance (number of matching ingredients) for fuzzy search
-    if mode == 'fuzzy' and ingredient_ids:
-        # Subquery to count matching ingredients
-        query = query.order_by(Dish.updated_at.desc())
+    # Cards are read from the pre-joined summaries of the matched dishes
+    if page_ids is None:
+        dishes = DishSummary.query.order_by(DishSummary.updated_at.desc()).paginate(
+            page=page, per_page=per_page, error_out=False
+        )
     else:
-        query = query.order_by(Dish.updated_at.desc())
+        summaries = {s.id: s for s in DishSummary.query.filter(DishSummary.id.in_(page_ids))}
+        dishes = PrefetchedPagination(
+            page=page, per_page=per_page, max_per_page=None, error_out=False,
+            items=[summaries[i] for i in page_ids if i in summaries], total=total
+        )
 
-    # Paginate
-    dishes = query.paginate(page=page, per_page=per_page, error_out=False)
+    # Selected ingredient tags, in the order they were picked
+    selected = {i.id: i for i in Ingredient.query.filter(Ingredient.id.in_(ingredient_ids))}
+    selected_ingredients = [selected[i] for i in dict.fromkeys(ingredient_ids) if i in selected]
 
     categories = get_ingredients_by_category()
     genres = get_all_genres()
@@ -106,10 +182,14 @@ def search_dishes():
 
     return render_template(template,
                            categories=categories,
+                           ingredient_groups=iter_ingredient_groups(categories),
                            genres=genres,
                            dishes=dishes,
                            selected_ingredient_ids=ingredient_ids,
+                           selected_ingredients=selected_ingredients,
                            selected_genre_ids=genre_ids,
+                           genre_counts=genre_counts,
+                           ingredient_counts=ingredient_counts,
                            search_mode=mode,
                            mode=view_mode)
 
@@ -127,10 +207,10 @@ def dish_detail(id):
 
 
 def parse_comma_separated_ids(value):
-    """Parse comma-separated string into list of integers"""
+    """Parse comma-separated string into list of unique integers (first occurrence order)"""
     if not value:
         return []
-    return [int(x) for x in value.split(',') if x.strip().isdigit()]
+    return list(dict.fromkeys(int(x) for x in value.split(',') if x.strip().isdigit()))
 
 
 @main_bp.route('/dish/new', methods=['GET', 'POST'])
@@ -149,29 +229,32 @@ def dish_new():
         form._ingredient_ids_list = ingredient_ids
 
         if form.validate_on_submit():
-            dish = Dish(
-                name=form.name.data,
-                difficulty=form.difficulty.data,
-                memo=form.memo.data
-            )
-
-            # Add genres
-            for genre_id in form.genre_ids.data:
-                genre = DishGenre.query.get(genre_id)
-                if genre:
-                    dish.genres.append(genre)
-
-            # Add ingredients
-            for ingredient_id in ingredient_ids:
-                ingredient = Ingredient.query.get(ingredient_id)
-                if ingredient:
-                    dish.ingredients.append(ingredient)
-
-            db.session.add(dish)
-            db.session.commit()
-
-            flash('料理を登録しました', 'success')
-            return redirect(url_for('main.edit_mode'))
+            try:
+                with serialized_write():
+                    dish = Dish(
+                        name=form.name.data,
+                        difficulty=form.difficulty.data,
+                        memo=form.memo.data
+                    )
+
+                    # Add genres
+                    for genre_id in dict.fromkeys(form.genre_ids.data):
+                        genre = DishGenre.query.get(genre_id)
+                        if genre:
+                            dish.genres.append(genre)
+
+                    # Add ingredients
+                    for ingredient_id in ingredient_ids:
+                        ingredient = Ingredient.query.get(ingredient_id)
+                        if ingredient:
+                            dish.ingredients.append(ingredient)
+
+                    db.session.add(dish)
+            except WriteConflict:
+                flash('料理を登録できませんでした', 'error')
+            else:
+                flash('料理を登録しました', 'success')
+                return redirect(url_for('main.edit_mode'))
 
     categories = get_ingredients_by_category()
 
@@ -205,33 +288,35 @@ def dish_edit(id):
         form._ingredient_ids_list = ingredient_ids
 
         if form.validate_on_submit():
-            dish.name = form.name.data
-            dish.difficulty = form.difficulty.data
-            dish.memo = form.memo.data
-
-            # Update genres
-            dish.genres.clear()
-            for genre_id in form.genre_ids.data:
-                genre = DishGenre.query.get(genre_id)
-                if genre:
-                    dish.genres.append(genre)
-
-            # Update ingredients
-            dish.ingredients.clear()
-            for ingredient_id in ingredient_ids:
-                ingredient = Ingredient.query.get(ingredient_id)
-                if ingredient:
-                    dish.ingredients.append(ingredient)
-
-            db.session.commit()
-
-            flash('料理を更新しました', 'success')
-
-            # Return to referrer or detail page
-            referrer = form.referrer.data
-            if referrer and 'dish/' in referrer:
-                return redirect(url_for('main.dish_detail', id=dish.id))
-            return redirect(referrer or url_for('main.edit_mode'))
+            try:
+                with serialized_write():
+                    dish.name = form.name.data
+                    dish.difficulty = form.difficulty.data
+                    dish.memo = form.memo.data
+
+                    # Update genres
+                    dish.genres.clear()
+                    for genre_id in dict.fromkeys(form.genre_ids.data):
+                        genre = DishGenre.query.get(genre_id)
+                        if genre:
+                            dish.genres.append(genre)
+
+                    # Update ingredients
+                    dish.ingredients.clear()
+                    for ingredient_id in ingredient_ids:
+                        ingredient = Ingredient.query.get(ingredient_id)
+                        if ingredient:
+                            dish.ingredients.append(ingredient)
+            except WriteConflict:
+                flash('料理を更新できませんでした', 'error')
+            else:
+                flash('料理を更新しました', 'success')
+
+                # Return to referrer or detail page
+                referrer = form.referrer.data
+                if referrer and 'dish/' in referrer:
+                    return redirect(url_for('main.dish_detail', id=dish.id))
+                return redirect(referrer or url_for('main.edit_mode'))
 
     categories = get_ingredients_by_category()
     genres = get_all_genres()
@@ -248,10 +333,13 @@ def dish_edit(id):
 def dish_delete(id):
     """Delete a dish"""
     dish = Dish.query.get_or_404(id)
-    db.session.delete(dish)
-    db.session.commit()
-
-    flash('料理を削除しました', 'success')
+    try:
+        with serialized_write():
+            db.session.delete(dish)
+    except WriteConflict:
+        flash('料理を削除できませんでした', 'error')
+    else:
+        flash('料理を削除しました', 'success')
     return redirect(url_for('main.edit_mode'))
 
 
@@ -266,24 +354,15 @@ def ingredient_new():
     form.category_id.choices = [(c.id, c.name) for c in IngredientCategory.query.order_by(IngredientCategory.display_order).all()]
 
     if form.validate_on_submit():
-        # Check for duplicate name
-        existing = Ingredient.query.filter_by(name=form.name.data).first()
-        if existing:
-            flash('同じ名前の原材料が既に存在します', 'error')
+        try:
+            with serialized_write():
+                create_ingredient(form.name.data, form.category_id.data)
+        except WriteConflict as e:
+            if e.is_unique('ingredients.name'):
+                flash('同じ名前の原材料が既に存在します', 'error')
+            else:
+                flash('原材料を登録できませんでした', 'error')
         else:
-            # Get max display_order for the category
-            max_order = db.session.query(func.max(Ingredient.display_order)).filter_by(
-                category_id=form.category_id.data
-            ).scalar() or 0
-
-            ingredient = Ingredient(
-                name=form.name.data,
-                category_id=form.category_id.data,
-                display_order=max_order + 1
-            )
-            db.session.add(ingredient)
-            db.session.commit()
-
             flash('原材料を登録しました', 'success')
 
             # Return to referrer
@@ -312,11 +391,11 @@ def ingredients():
 
     delete_form = DeleteIngredientForm()
 
-    return render_template('ingredient_manage.html',
-                           categories=categories,
-                           filtered_categories=filtered_categories,
-                           selected_category_id=category_id,
-                           delete_form=delete_form)
+    return stream_page('ingredient_manage.html',
+                       categories=categories,
+                       ingredient_groups=iter_ingredient_groups(filtered_categories),
+                       selected_category_id=category_id,
+                       delete_form=delete_form)
 
 
 @main_bp.route('/ingredient/<int:id>/check-usage')
@@ -337,12 +416,16 @@ def ingredient_check_usage(id):
 def ingredient_delete(id):
     """Delete an ingredient"""
     ingredient = Ingredient.query.get_or_404(id)
+    name = ingredient.name
 
     # The CASCADE will handle removing the ingredient from dishes
-    db.session.delete(ingredient)
-    db.session.commit()
-
-    flash(f'「{ingredient.name}」を削除しました', 'success')
+    try:
+        with serialized_write():
+            db.session.delete(ingredient)
+    except WriteConflict:
+        flash(f'「{name}」を削除できませんでした', 'error')
+    else:
+        flash(f'「{name}」を削除しました', 'success')
     return redirect(url_for('main.ingredients'))
 
 
@@ -382,23 +465,14 @@ def api_ingredient_create():
     if not category_id:
         return jsonify({"success": False, "error": "分類は必須です"}), 400
     
-    # Check for duplicate
-    existing = Ingredient.query.filter_by(name=name).first()
-    if existing:
-        return jsonify({"success": False, "error": "同じ名前の原材料が既に存在します"}), 400
-    
-    # Get max display_order for the category
-    max_order = db.session.query(func.max(Ingredient.display_order)).filter_by(
-        category_id=category_id
-    ).scalar() or 0
-    
-    ingredient = Ingredient(
-        name=name,
-        category_id=category_id,
-        display_order=max_order + 1
-    )
-    db.session.add(ingredient)
-    db.session.commit()
+    # A duplicate name violates the unique constraint inside the write
+    try:
+        with serialized_write():
+            ingredient = create_ingredient(name, category_id)
+    except WriteConflict as e:
+        if e.is_unique('ingredients.name'):
+            return jsonify({"success": False, "error": "同じ名前の原材料が既に存在します"}), 409
+        return jsonify({"success": False, "error": "原材料を登録できませんでした"}), 409
     
     return jsonify({
         "success": True,
@@ -411,3 +485,66 @@ def api_categories():
     """Get all ingredient categories (for modal)"""
     categories = IngredientCategory.query.order_by(IngredientCategory.display_order).all()
     return jsonify([{"id": c.id, "name": c.name} for c in categories])
+
+
+@main_bp.route("/api/changes")
+def api_changes():
+    """Change feed entries after ``since`` (one batch per request)"""
+    since = max(request.args.get('since', 0, type=int), 0)
+    batch_size = current_app.config['CHANGE_FEED_BATCH_SIZE']
+    limit = min(max(request.args.get('limit', batch_size, type=int), 1), batch_size)
+
+    # Tombstones below the floor were compacted away. A resync (paging from
+    # since=0) echoes the floor it started under, and its cursors stay valid
+    # until a later compaction moves the floor again.
+    floor = get_change_log_floor()
+    if 0 < since < floor and request.args.get('floor', type=int) != floor:
+        return jsonify({"success": False, "error": "resync required", "floor": floor}), 410
+
+    entries = ChangeLog.query.filter(ChangeLog.seq > since).order_by(ChangeLog.seq).limit(limit + 1).all()
+    has_more = len(entries) > limit
+    entries = entries[:limit]
+    high_water_mark = db.session.query(func.max(ChangeLog.seq)).scalar() or 0
+
+    return jsonify({
+        "changes": [e.to_dict() for e in entries],
+        "next_since": entries[-1].seq if entries else since,
+        "high_water_mark": high_water_mark,
+        "floor": floor,
+        "has_more": has_more
+    })
+
+
+def _catalog_response(snapshot, cache_control):
+    """Serve a catalog snapshot in the best encoding the client accepts"""
+    encoding, payload = snapshot.encode_for(request.accept_encodings)
+    response = current_app.response_class(payload, mimetype='application/json')
+    if encoding:
+        response.headers['Content-Encoding'] = encoding
+    response.headers['Vary'] = 'Accept-Encoding'
+    response.headers['Cache-Control'] = cache_control
+    response.set_etag(f'{snapshot.version}-{encoding or "identity"}')
+    return response.make_conditional(request)
+
+
+@main_bp.route("/api/catalog")
+def api_catalog():
+    """Current ingredient/category/genre catalog (revalidated via ETag)"""
+    return _catalog_response(get_catalog_snapshot(), 'no-cache')
+
+
+@main_bp.route("/api/catalog/<version>")
+def api_catalog_version(version):
+    """Content-hashed catalog snapshot (cached forever by the browser)"""
+    snapshot = get_catalog_snapshot()
+    if version != snapshot.version:
+        return redirect(url_for('main.api_catalog_version', version=snapshot.version))
+    return _catalog_response(snapshot, 'public, max-age=31536000, immutable')
+
+
+@main_bp.app_context_processor
+def inject_catalog_url():
+    """Expose catalog_url() so templates can link the current snapshot"""
+    def catalog_url():
+        return url_for('main.api_catalog_version', version=get_catalog_snapshot().version)
+    return {'catalog_url': catalog_url}
@@ -0,0 +1,170 @@
+"""Maintenance of the dish_summaries projection.
+
+Each dish_summaries row holds what a dish card needs (name, difficulty,
+genre names, ingredient names joined by '、', ingredient count and the packed
+ingredient id list), so list pages read one table instead of three.
+
+Rows are rewritten from session flush hooks, in the same transaction as the
+change that made them stale: dish inserts/updates/deletes, association
+changes, and ingredient renames or deletes.
+"""
+from sqlalchemy import event, inspect
+
+from app import db
+from app.models import (Dish, DishGenre, DishSummary, Ingredient,
+                        dish_genre_relations, dish_ingredient_relations)
+
+CHUNK_SIZE = 500
+
+# Same order as the Dish.genres / Dish.ingredients relationships
+GENRE_ORDER = db.literal_column('dish_genre_relations.rowid')
+INGREDIENT_ORDER = db.literal_column('dish_ingredient_relations.rowid')
+_PENDING_KEY = 'dish_summaries_pending'
+
+
+def _chunks(ids):
+    ids = list(ids)
+    for i in range(0, len(ids), CHUNK_SIZE):
+        yield ids[i:i + CHUNK_SIZE]
+
+
+def build_summary_rows(conn, dish_ids):
+    """Compute summary rows for the given dish ids from the base tables"""
+    dish_ids = list(dish_ids)
+    if not dish_ids:
+        return {}
+
+    rows = {}
+    for dish_id, name, difficulty, updated_at in conn.execute(
+        db.select(Dish.id, Dish.name, Dish.difficulty, Dish.updated_at)
+        .where(Dish.id.in_(dish_ids))
+    ):
+        rows[dish_id] = {
+            'id': dish_id,
+            'name': name,
+            'difficulty': difficulty,
+            'updated_at': updated_at,
+            'genre_names': [],
+            'ingredient_names': [],
+            'ingredient_ids': [],
+        }
+
+    for dish_id, genre_name in conn.execute(
+        db.select(dish_genre_relations.c.dish_id, DishGenre.name)
+        .join(DishGenre, DishGenre.id == dish_genre_relations.c.genre_id)
+        .where(dish_genre_relations.c.dish_id.in_(dish_ids))
+        .order_by(dish_genre_relations.c.dish_id, GENRE_ORDER)
+    ):
+        if dish_id in rows:
+            rows[dish_id]['genre_names'].append(genre_name)
+
+    for dish_id, ingredient_id, ingredient_name in conn.execute(
+        db.select(dish_ingredient_relations.c.dish_id, Ingredient.id, Ingredient.name)
+        .join(Ingredient, Ingredient.id == dish_ingredient_relations.c.ingredient_id)
+        .where(dish_ingredient_relations.c.dish_id.in_(dish_ids))
+        .order_by(dish_ingredient_relations.c.dish_id, INGREDIENT_ORDER)
+    ):
+        if dish_id in rows:
+            rows[dish_id]['ingredient_names'].append(ingredient_name)
+            rows[dish_id]['ingredient_ids'].append(ingredient_id)
+
+    for row in rows.values():
+        ingredient_ids = row.pop('ingredient_ids')
+        row['genre_names'] = '、'.join(row['genre_names'])
+        row['ingredient_names'] = '、'.join(row['ingredient_names'])
+        row['ingredient_count'] = len(ingredient_ids)
+        row['ingredient_ids_packed'] = ','.join(str(i) for i in ingredient_ids)
+    return rows
+
+
+def refresh_dish_summaries(conn, dish_ids):
+    """Rewrite the summary rows of the given dishes (missing dishes are dropped)"""
+    table = DishSummary.__table__
+    for chunk in _chunks(set(dish_ids)):
+        conn.execute(table.delete().where(table.c.id.in_(chunk)))
+        rows = build_summary_rows(conn, chunk)
+        if rows:
+            conn.execute(table.insert(), list(rows.values()))
+
+
+def rebuild_dish_summaries(conn):
+    """Rebuild the whole projection from the base tables"""
+    conn.execute(DishSummary.__table__.delete())
+    dish_ids = conn.execute(db.select(Dish.id).order_by(Dish.id)).scalars().all()
+    refresh_dish_summaries(conn, dish_ids)
+    return len(dish_ids)
+
+
+def check_dish_summaries(conn):
+    """Compare the projection against the base tables.
+
+    Returns a dict with lists of dish ids that are missing a summary, have a
+    stale summary, or have a summary but no longer exist.
+    """
+    columns = [c.name for c in DishSummary.__table__.columns]
+    stored_ids = set(conn.execute(db.select(DishSummary.id)).scalars())
+    dish_ids = conn.execute(db.select(Dish.id).order_by(Dish.id)).scalars().all()
+
+    missing, stale = [], []
+    for chunk in _chunks(dish_ids):
+        expected = build_summary_rows(conn, chunk)
+        stored = {
+            row.id: dict(row._mapping)
+            for row in conn.execute(db.select(DishSummary.__table__).where(DishSummary.id.in_(chunk)))
+        }
+        for dish_id, row in expected.items():
+            if dish_id not in stored:
+                missing.append(dish_id)
+            elif any(stored[dish_id][c] != row[c] for c in columns):
+                stale.append(dish_id)
+
+    orphaned = sorted(stored_ids - set(dish_ids))
+    return {'missing': missing, 'stale': stale, 'orphaned': orphaned}
+
+
+# =============================================================================
+# Session hooks
+# =============================================================================
+
+@event.listens_for(db.session, 'before_flush')
+def _collect_stale_dishes(session, flush_context, instances):
+    """Remember which dishes the pending flush will make stale"""
+    pending = session.info.setdefault(_PENDING_KEY, {'dishes': set(), 'ids': set()})
+
+    for obj in list(session.new) + list(session.dirty):
+        if isinstance(obj, Dish):
+            pending['dishes'].add(obj)
+
+    for obj in session.deleted:
+        if isinstance(obj, Dish) and obj.id is not None:
+            pending['ids'].add(obj.id)
+
+    # Ingredient renames and deletes change the cards of every dish using it
+    changed_ingredient_ids = [
+        obj.id for obj in session.deleted if isinstance(obj, Ingredient) and obj.id is not None
+    ] + [
+        obj.id for obj in session.dirty
+        if isinstance(obj, Ingredient) and obj.id is not None
+        and inspect(obj).attrs.name.history.has_changes()
+    ]
+    if changed_ingredient_ids:
+        pending['ids'].update(session.connection().execute(
+            db.select(dish_ingredient_relations.c.dish_id)
+            .where(dish_ingredient_relations.c.ingredient_id.in_(changed_ingredient_ids))
+        ).scalars())
+
+
+@event.listens_for(db.session, 'after_flush')
+def _refresh_stale_dishes(session, flush_context):
+    """Rewrite summaries in the flush's own transaction"""
+    pending = session.info.pop(_PENDING_KEY, None)
+    if not pending:
+        return
+    dish_ids = pending['ids'] | {d.id for d in pending['dishes'] if d.id is not None}
+    if dish_ids:
+        refresh_dish_summaries(session.connection(), dish_ids)
+
+
+@event.listens_for(db.session, 'after_rollback')
+def _discard_pending(session):
+    session.info.pop(_PENDING_KEY, None)
@@ -0,0 +1,88 @@
+"""Serialized write path for SQLite.
+
+SQLite allows a single writer at a time. Letting every request race for the
+write lock produces "database is locked" errors and read-then-write races, so
+all mutations go through ``serialized_write()``: writers queue on an
+in-process lock and each transaction is opened with ``BEGIN IMMEDIATE`` so the
+database write lock is held from the first statement.
+"""
+import threading
+from contextlib import contextmanager
+
+from sqlalchemy import event
+from sqlalchemy.exc import IntegrityError
+
+from app import db
+
+_write_lock = threading.Lock()
+
+
+class WriteConflict(Exception):
+    """Raised when a write violates a constraint (e.g. duplicate name)
+
+    ``constraint`` is the kind SQLite reports (UNIQUE, NOT NULL, CHECK,
+    FOREIGN KEY) and ``columns`` the columns it names, if any, so callers can
+    tell a duplicate name from any other failure.
+    """
+
+    def __init__(self, message):
+        super().__init__(message)
+        # e.g. "UNIQUE constraint failed: ingredients.name"
+        kind, found, columns = message.partition(' constraint failed')
+        self.constraint = kind if found else None
+        self.columns = tuple(c.strip() for c in columns.lstrip(':').split(',') if c.strip())
+
+    def is_unique(self, column):
+        """True if this is a UNIQUE violation on ``column`` (table.column)"""
+        return self.constraint == 'UNIQUE' and column in self.columns
+
+
+def init_sqlite_engine(engine, busy_timeout=5000):
+    """Take over transaction handling on the pysqlite driver.
+
+    pysqlite issues its own deferred BEGIN, which cannot be made IMMEDIATE.
+    Disabling it and emitting BEGIN from the engine lets a connection opt in
+    to ``BEGIN IMMEDIATE`` via the ``sqlite_begin_immediate`` option.
+    """
+    if engine.dialect.name != 'sqlite':
+        return
+
+    @event.listens_for(engine, 'connect')
+    def _on_connect(dbapi_connection, connection_record):
+        dbapi_connection.isolation_level = None
+        cursor = dbapi_connection.cursor()
+        cursor.execute(f'PRAGMA busy_timeout = {int(busy_timeout)}')
+        # Readers don't block the writer; committed pages live in <db>-wal until
+        # a checkpoint, so copy the database with `flask menudb backup`
+        cursor.execute('PRAGMA journal_mode = WAL')
+        cursor.close()
+
+    @event.listens_for(engine, 'begin')
+    def _on_begin(conn):
+        if conn.get_execution_options().get('sqlite_begin_immediate'):
+            conn.exec_driver_sql('BEGIN IMMEDIATE')
+        else:
+            conn.exec_driver_sql('BEGIN')
+
+
+@contextmanager
+def serialized_write():
+    """Run the enclosed session changes as one serialized write transaction.
+
+    Any read transaction already open on the session is closed first, so all
+    mutations must happen inside the block. Commits on success, rolls back on
+    error, and turns constraint violations into ``WriteConflict``.
+    """
+    with _write_lock:
+        if db.session().in_transaction():
+            db.session.commit()
+        db.session.connection(execution_options={'sqlite_begin_immediate': True})
+        try:
+            yield
+            db.session.commit()
+        except IntegrityError as e:
+            db.session.rollback()
+            raise WriteConflict(str(e.orig)) from e
+        except Exception:
+            db.session.rollback()
+            raise
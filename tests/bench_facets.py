@@ -0,0 +1,224 @@
+"""
+Search and facet count benchmark.
+
+Seeds a temporary database (100k dishes by default), then times the
+in-memory dish index for each search shape against the 20 ms budget,
+both the index call alone and /search end to end. The index is loaded in
+the background while a /search is served from the SQL fallback, which is
+timed too. Before timing, a few random searches of every shape are checked
+against the equivalent SQL, both right after loading and after writes
+replayed from the change feed, and the SQL fallback is checked as well.
+Prints a JSON report and OK/FAILED.
+Run with: python -m tests.bench_facets [--dishes 100000] [--ingredients 300]
+"""
+
+import argparse
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+from urllib.parse import urlencode
+
+# Add parent directory to path for imports
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+BUDGET_MS = 20
+
+# name -> (genre count, ingredient count, mode)
+SHAPES = {
+    'no_filter': (0, 0, 'fuzzy'),
+    'one_genre': (1, 0, 'fuzzy'),
+    'two_genres': (2, 0, 'fuzzy'),
+    'fuzzy_3_ingredients': (0, 3, 'fuzzy'),
+    'exact_2_ingredients': (0, 2, 'exact'),
+    'genre_and_fuzzy_3': (1, 3, 'fuzzy'),
+    'genre_and_exact_2': (1, 2, 'exact'),
+}
+
+
+def random_search(shape, ingredient_count, rng):
+    genre_n, ingredient_n, mode = SHAPES[shape]
+    return (rng.sample(range(1, 9), genre_n),
+            rng.sample(range(1, ingredient_count + 1), ingredient_n), mode)
+
+
+def sql_search(genre_ids, ingredient_ids, mode):
+    """Matched ids and disjunctive facet counts computed with plain SQL"""
+    from sqlalchemy import func
+
+    from app import db
+    from app.models import (Dish, DishGenre, Ingredient,
+                            dish_genre_relations, dish_ingredient_relations)
+
+    def dish_query(genres, ingredients):
+        query = Dish.query.with_entities(Dish.id)
+        if genres:
+            query = query.filter(Dish.genres.any(DishGenre.id.in_(genres)))
+        if ingredients and mode == 'exact':
+            for ingredient_id in ingredients:
+                query = query.filter(Dish.ingredients.any(Ingredient.id == ingredient_id))
+        elif ingredients:
+            query = query.filter(Dish.ingredients.any(Ingredient.id.in_(ingredients)))
+        return query
+
+    def counts(table, column, query):
+        return dict(
+            db.session.query(column, func.count())
+            .filter(table.c.dish_id.in_(query))
+            .group_by(column)
+            .all()
+        )
+
+    matched = dish_query(genre_ids, ingredient_ids)
+    genre_counts = counts(dish_genre_relations, dish_genre_relations.c.genre_id,
+                          dish_query([], ingredient_ids))
+    ingredient_counts = counts(dish_ingredient_relations, dish_ingredient_relations.c.ingredient_id,
+                               matched if mode == 'exact' else dish_query(genre_ids, []))
+    return {dish_id for dish_id, in matched}, genre_counts, ingredient_counts
+
+
+def check(app, ingredient_count, rng, samples, search=None):
+    """Compare index (or ``search``) results with SQL; returns the number of mismatches"""
+    from app import db
+    from app.facets import search_index
+
+    search = search or search_index
+
+    mismatches = 0
+    with app.test_request_context():
+        for shape in SHAPES:
+            if shape == 'no_filter':
+                continue
+            for _ in range(samples):
+                genre_ids, ingredient_ids, mode = random_search(shape, ingredient_count, rng)
+                page, total, genre_counts, ingredient_counts = search(
+                    genre_ids, ingredient_ids, mode, 0, 10 ** 9
+                )
+                expected = sql_search(genre_ids, ingredient_ids, mode)
+                if (set(page), genre_counts, ingredient_counts) != expected or total != len(page):
+                    mismatches += 1
+        db.session.remove()
+    return mismatches
+
+
+def write_some(client, dish_count, ingredient_count, rng, writes):
+    """Edit and delete a few dishes through the app (fed to the change log)"""
+    for _ in range(writes):
+        dish_id = rng.randint(1, dish_count)
+        ids = rng.sample(range(1, ingredient_count + 1), rng.randint(1, 10))
+        client.post(f'/dish/{dish_id}/edit', data={
+            'name': f'料理{dish_id}', 'difficulty': rng.randint(1, 5),
+            'genre_ids': [rng.randint(1, 8)], 'ingredient_ids': ','.join(map(str, ids)),
+        })
+    for _ in range(writes // 4):
+        client.post(f'/dish/{rng.randint(1, dish_count)}/delete')
+
+
+def timings(values):
+    values = sorted(values)
+    return {
+        'p50_ms': round(values[len(values) // 2], 2),
+        'p99_ms': round(values[min(int(len(values) * 0.99), len(values) - 1)], 2),
+        'max_ms': round(values[-1], 2),
+    }
+
+
+def run(dish_count, ingredient_count, repeat, database_path):
+    """Seed, check and time; returns the report dict."""
+    os.environ['DATABASE_PATH'] = database_path
+
+    from app import create_app, db
+    from app.facets import get_dish_index, search_index, search_sql, start_dish_index_build
+    from tests.load_test import seed_database
+
+    app = create_app('testing')
+    with app.app_context():
+        seed_database(dish_count, ingredient_count, random.Random(0))
+        db.session.remove()
+
+    rng = random.Random(1)
+    client = app.test_client()
+
+    # Searches don't wait for the load; they are answered in SQL meanwhile
+    started = time.perf_counter()
+    build = start_dish_index_build(app)
+    response = client.get('/search?genre_ids=1,2&ingredient_ids=1')
+    during_load_ms = (time.perf_counter() - started) * 1000
+    assert response.status_code == 200
+    loaded_during_search = not build.is_alive()
+    build.join()
+    load_ms = (time.perf_counter() - started) * 1000
+
+    mismatches_after_load = check(app, ingredient_count, rng, 3)
+    mismatches_fallback = check(app, ingredient_count, rng, 1, search_sql)
+    write_some(client, dish_count, ingredient_count, rng, 40)
+    with app.test_request_context():
+        seq_before = get_dish_index().seq
+        started = time.perf_counter()
+        search_index([], [], 'fuzzy', 0, 10)
+        replay_ms = (time.perf_counter() - started) * 1000
+        replayed = get_dish_index().seq - seq_before
+        db.session.remove()
+    mismatches_after_replay = check(app, ingredient_count, rng, 3)
+
+    shapes = {}
+    for shape in SHAPES:
+        index_ms, request_ms = [], []
+        for _ in range(repeat):
+            genre_ids, ingredient_ids, mode = random_search(shape, ingredient_count, rng)
+            with app.test_request_context():
+                started = time.perf_counter()
+                search_index(genre_ids, ingredient_ids, mode, 0, 10)
+                index_ms.append((time.perf_counter() - started) * 1000)
+                db.session.remove()
+
+            query = {'mode': mode, 'genre_ids': ','.join(map(str, genre_ids)),
+                     'ingredient_ids': ','.join(map(str, ingredient_ids))}
+            started = time.perf_counter()
+            response = client.get('/search?' + urlencode(query))
+            request_ms.append((time.perf_counter() - started) * 1000)
+            assert response.status_code == 200
+        shapes[shape] = {'index': timings(index_ms), 'search_request': timings(request_ms)}
+
+    with app.app_context():
+        db.session.remove()
+        db.engine.dispose()
+
+    return {
+        'dataset': {'dishes': dish_count, 'ingredients': ingredient_count},
+        'budget_ms': BUDGET_MS,
+        'index_load_ms': round(load_ms, 1),
+        'search_during_load': {'ms': round(during_load_ms, 1), 'waited_for_load': loaded_during_search},
+        'replay': {'entries': replayed, 'ms': round(replay_ms, 2)},
+        'mismatches': {'after_load': mismatches_after_load, 'after_replay': mismatches_after_replay,
+                       'sql_fallback': mismatches_fallback},
+        'shapes': shapes,
+    }
+
+
+def main():
+    """Main entry point."""
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--dishes', type=int, default=100000)
+    parser.add_argument('--ingredients', type=int, default=300)
+    parser.add_argument('--repeat', type=int, default=30, help='searches per shape')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        report = run(args.dishes, args.ingredients, args.repeat, os.path.join(tmp, 'facets.db'))
+
+    print(json.dumps(report, ensure_ascii=False, indent=2))
+
+    ok = (
+        not any(report['mismatches'].values())
+        and not report['search_during_load']['waited_for_load']
+        and all(s['index']['p99_ms'] <= BUDGET_MS for s in report['shapes'].values())
+    )
+    print('OK' if ok else 'FAILED')
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,172 @@
+"""
+Time-to-first-byte and memory benchmark for the streamed list pages.
+
+For each catalog size a database is seeded in its own subprocess, then each
+page is measured in a fresh process that only opens it: /edit listing every
+dish on one page (MAX_ITEMS_PER_PAGE is raised for the benchmark so the
+dish rows really stream) and /ingredients. Reports time to first byte,
+total time, peak Python allocation during the request (tracemalloc) and the
+process RSS before the request and its peak while streaming, as JSON.
+RSS is read from /proc, so the benchmark runs on Linux only.
+Run with: python -m tests.bench_streaming [--sizes 1000,10000,40000]
+"""
+
+import argparse
+import json
+import os
+import random
+import resource
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+
+# Add parent directory to path for imports
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+PAGES = {
+    'edit_mode': '/edit?per_page={size}',
+    'ingredients': '/ingredients',
+}
+
+
+def current_rss_mb():
+    """Resident set size of this process right now"""
+    with open('/proc/self/statm') as f:
+        resident_pages = int(f.read().split()[1])
+    return resident_pages * resource.getpagesize() / (1024 * 1024)
+
+
+class RssSampler(threading.Thread):
+    """Poll current RSS in the background and keep the maximum"""
+
+    def __init__(self, interval=0.002):
+        super().__init__(daemon=True)
+        self.interval = interval
+        self.peak = current_rss_mb()
+        self.stopped = threading.Event()
+
+    def run(self):
+        while not self.stopped.is_set():
+            self.peak = max(self.peak, current_rss_mb())
+            time.sleep(self.interval)
+
+    def stop(self):
+        self.stopped.set()
+        self.join()
+        self.peak = max(self.peak, current_rss_mb())
+        return self.peak
+
+
+def measure(client, path):
+    """Stream one response, returning TTFB, total time, allocation and RSS"""
+    rss_before = current_rss_mb()
+    sampler = RssSampler()
+    sampler.start()
+    tracemalloc.start()
+    started = time.perf_counter()
+    response = client.get(path, buffered=False)
+    chunks = iter(response.response)
+    first = next(chunks, b'')
+    ttfb = time.perf_counter() - started
+    size = len(first) + sum(len(chunk) for chunk in chunks)
+    total = time.perf_counter() - started
+    response.close()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    rss_peak = sampler.stop()
+
+    return {
+        'status': response.status_code,
+        'bytes': size,
+        'ttfb_ms': round(ttfb * 1000, 2),
+        'total_ms': round(total * 1000, 2),
+        'peak_alloc_kb': round(peak / 1024, 1),
+        'rss_before_mb': round(rss_before, 1),
+        'rss_peak_mb': round(rss_peak, 1),
+        'rss_delta_mb': round(rss_peak - rss_before, 1),
+    }
+
+
+def seed(size, database_path):
+    """Seed ``size`` dishes and ingredients into a new database"""
+    os.environ['DATABASE_PATH'] = database_path
+
+    from app import create_app, db
+    from tests.load_test import seed_database
+
+    app = create_app('testing')
+    with app.app_context():
+        seed_database(size, size, random.Random(0))
+        db.session.remove()
+        db.engine.dispose()
+
+
+def run_single(size, page, database_path):
+    """Measure one page against an already seeded database"""
+    os.environ['DATABASE_PATH'] = database_path
+
+    from app import create_app
+
+    app = create_app('testing')
+    app.config['MAX_ITEMS_PER_PAGE'] = max(size, app.config['MAX_ITEMS_PER_PAGE'])
+    client = app.test_client()
+
+    # Warm up templates, connections and the cached catalog snapshot (built
+    # once per catalog change) with small responses, so the measured request
+    # starts from a small heap
+    client.get('/edit?per_page=1').get_data()
+    app.jinja_env.get_template('ingredient_manage.html')
+
+    return measure(client, PAGES[page].format(size=size))
+
+
+def run_subprocess(*args):
+    out = subprocess.run(
+        [sys.executable, '-m', 'tests.bench_streaming', *map(str, args)],
+        check=True, capture_output=True, text=True, cwd=ROOT,
+    )
+    return out.stdout.strip().splitlines()[-1] if out.stdout.strip() else None
+
+
+def main():
+    """Main entry point."""
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--sizes', default='1000,10000,40000',
+                        help='comma-separated catalog sizes (dishes and ingredients)')
+    parser.add_argument('--seed', type=int, help=argparse.SUPPRESS)
+    parser.add_argument('--single', type=int, help=argparse.SUPPRESS)
+    parser.add_argument('--page', choices=sorted(PAGES), help=argparse.SUPPRESS)
+    parser.add_argument('--db', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.seed:
+        seed(args.seed, args.db)
+        return
+    if args.single:
+        print(json.dumps(run_single(args.single, args.page, args.db)))
+        return
+
+    results = []
+    with tempfile.TemporaryDirectory() as tmp:
+        for size in (int(s) for s in args.sizes.split(',')):
+            database_path = os.path.join(tmp, f'bench-{size}.db')
+            # Seeding's own memory use stays in its process; each page is
+            # then measured in a fresh process so RSS is comparable
+            run_subprocess('--seed', size, '--db', database_path)
+            result = {'size': size}
+            for page in PAGES:
+                result[page] = json.loads(
+                    run_subprocess('--single', size, '--page', page, '--db', database_path)
+                )
+            results.append(result)
+
+    print(json.dumps(results, ensure_ascii=False, indent=2))
+
+
+if __name__ == '__main__':
+    main()
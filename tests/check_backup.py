@@ -0,0 +1,145 @@
+"""
+Online backup under writes.
+
+Seeds a temporary database, then takes a backup while a writer thread
+creates dishes through the app at a fixed interval. Reports how often the
+stepped copy restarted, whether it fell back to a single-step copy, how long
+it took, how many writes landed meanwhile, and checks that the snapshot
+passes integrity_check and holds a dish count between the counts before and
+after the backup.
+Run with: python -m tests.check_backup [--dishes 20000] [--intervals 0,100,5]
+"""
+
+import argparse
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+
+# Add parent directory to path for imports
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+TIMEOUT_SEC = 120
+
+
+def dish_count(path):
+    conn = sqlite3.connect(path)
+    try:
+        return conn.execute('SELECT count(*) FROM dishes').fetchone()[0]
+    finally:
+        conn.close()
+
+
+def run_one(app, database_path, backup_dir, interval_ms):
+    """Back up while writing every ``interval_ms`` (0 = no writes)"""
+    from app.backup import backup_database
+
+    stop = threading.Event()
+    writes = []
+
+    def writer():
+        client = app.test_client()
+        while not stop.is_set():
+            n = len(writes)
+            response = client.post('/dish/new', data={
+                'name': f'バックアップ中{interval_ms}-{n}', 'difficulty': 1 + n % 5,
+                'genre_ids': [1 + n % 8], 'ingredient_ids': str(1 + n % 20),
+            })
+            writes.append(response.status_code)
+            stop.wait(interval_ms / 1000)
+
+    before = dish_count(database_path)
+    thread = threading.Thread(target=writer, daemon=True)
+    if interval_ms:
+        thread.start()
+        time.sleep(0.2)  # let the writer get going before the copy starts
+
+    report, error = {}, None
+    done = threading.Event()
+
+    def backup():
+        nonlocal report, error
+        try:
+            report = backup_database(database_path, backup_dir, keep=0)
+        except Exception as e:
+            error = e
+        done.set()
+
+    threading.Thread(target=backup, daemon=True).start()
+    finished = done.wait(TIMEOUT_SEC)
+    stop.set()
+    if interval_ms:
+        thread.join()
+    after = dish_count(database_path)
+
+    result = {
+        'interval_ms': interval_ms,
+        'finished': finished and error is None,
+        'error': repr(error) if error else None,
+        'writes': len(writes),
+        'write_errors': sum(1 for status in writes if status >= 400),
+    }
+    if result['finished']:
+        snapshot = sqlite3.connect(report['path'])
+        integrity = snapshot.execute('PRAGMA integrity_check').fetchone()[0]
+        snapshot_dishes = snapshot.execute('SELECT count(*) FROM dishes').fetchone()[0]
+        snapshot.close()
+        os.remove(report['path'])
+        result.update({
+            'restarts': report['restarts'],
+            'single_step': report['single_step'],
+            'steps': report['steps'],
+            'elapsed_sec': report['elapsed_sec'],
+            'integrity': integrity,
+            'consistent': before <= snapshot_dishes <= after,
+        })
+    return result
+
+
+def run(dishes, intervals, database_path, backup_dir):
+    """Seed once, then back up under each write interval."""
+    os.environ['DATABASE_PATH'] = database_path
+
+    from app import create_app, db
+    from tests.load_test import seed_database
+
+    app = create_app('testing')
+    with app.app_context():
+        seed_database(dishes, 300, random.Random(0))
+        db.session.remove()
+
+    results = [run_one(app, database_path, backup_dir, interval) for interval in intervals]
+
+    with app.app_context():
+        db.session.remove()
+        db.engine.dispose()
+    return results
+
+
+def main():
+    """Main entry point."""
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--dishes', type=int, default=20000)
+    parser.add_argument('--intervals', default='0,100,5',
+                        help='comma-separated ms between writes (0 = no writes)')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        results = run(args.dishes, [int(i) for i in args.intervals.split(',')],
+                      os.path.join(tmp, 'backup.db'), os.path.join(tmp, 'backups'))
+
+    ok = True
+    for result in results:
+        print(f"writes every {result.pop('interval_ms')} ms:")
+        for key, value in result.items():
+            print(f'  {key}: {value}')
+        ok = ok and result['finished'] and result['integrity'] == 'ok' and result['consistent']
+    print('OK' if ok else 'FAILED')
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,140 @@
+"""
+Change feed resync check.
+
+Deletes dishes, compacts the change log so their tombstones are dropped,
+then checks that a stale cursor gets 410, that a resync from since=0 can
+page to the end in small batches, that the replayed state matches the
+database, and that a compaction during a resync makes it start over.
+Run with: python -m tests.check_change_feed [--dishes N] [--limit N]
+"""
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+# Add parent directory to path for imports
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def resync(client, limit, on_batch=None):
+    """Replay the feed from since=0; returns (state, requests, statuses)"""
+    state = {'dish': {}, 'ingredient': {}}
+    since, floor, requests, statuses = 0, None, 0, []
+    while True:
+        query = {'since': since, 'limit': limit}
+        if floor is not None:
+            query['floor'] = floor
+        response = client.get('/api/changes', query_string=query)
+        requests += 1
+        statuses.append(response.status_code)
+        if response.status_code == 410:
+            # Start over with empty local state
+            state = {'dish': {}, 'ingredient': {}}
+            since, floor = 0, None
+            continue
+        body = response.get_json()
+        if floor is None:
+            floor = body['floor']
+        for change in body['changes']:
+            if change['op'] == 'delete':
+                state[change['entity']].pop(change['id'], None)
+            else:
+                state[change['entity']][change['id']] = change['data']
+        since = body['next_since']
+        if on_batch:
+            on_batch(requests)
+        if not body['has_more']:
+            return state, requests, statuses
+
+
+def run(dish_count, limit, database_path):
+    """Run the scenario and return a dict of results."""
+    os.environ['DATABASE_PATH'] = database_path
+
+    from app import create_app, db
+    from app.changes import compact_change_log
+    from app.models import Dish, Ingredient
+
+    app = create_app('testing')
+    client = app.test_client()
+
+    def compact():
+        time.sleep(0.01)  # retention 0 drops tombstones older than now
+        with app.app_context(), db.engine.begin() as conn:
+            return compact_change_log(conn, 0)
+
+    for i in range(dish_count):
+        client.post('/dish/new', data={
+            'name': f'フィード{i}', 'difficulty': 1 + i % 5,
+            'genre_ids': [1 + i % 8], 'ingredient_ids': str(1 + i % 20),
+        })
+    stale_since = client.get('/api/changes?since=0&limit=1').get_json()['next_since']
+
+    with app.app_context():
+        ids = [d.id for d in Dish.query.filter(Dish.name.like('フィード%')).order_by(Dish.id)]
+    for dish_id in ids[::2]:
+        client.post(f'/dish/{dish_id}/delete')
+    _, floor = compact()
+
+    stale = client.get('/api/changes', query_string={'since': stale_since})
+    state, requests, statuses = resync(client, limit)
+
+    # A compaction in the middle of a resync moves the floor again
+    def delete_and_compact(n):
+        if n == 2:
+            client.post(f'/dish/{ids[1]}/delete')
+            compact()
+
+    restarted_state, restarted_requests, restarted_statuses = resync(client, limit, delete_and_compact)
+
+    with app.app_context():
+        dish_ids = {d.id for d in Dish.query}
+        ingredient_ids = {i.id for i in Ingredient.query}
+        db.session.remove()
+        db.engine.dispose()
+
+    return {
+        'floor': floor,
+        'stale_status': stale.status_code,
+        'resync_requests': requests,
+        'resync_410s': statuses.count(410),
+        'resync_matches': (set(state['dish']), set(state['ingredient'])) == (
+            dish_ids | {ids[1]}, ingredient_ids
+        ),
+        'restarted_requests': restarted_requests,
+        'restarted_410s': restarted_statuses.count(410),
+        'restarted_matches': (set(restarted_state['dish']), set(restarted_state['ingredient'])) == (
+            dish_ids, ingredient_ids
+        ),
+    }
+
+
+def main():
+    """Main entry point."""
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--dishes', type=int, default=40)
+    parser.add_argument('--limit', type=int, default=3, help='batch size while resyncing')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        result = run(args.dishes, args.limit, os.path.join(tmp, 'feed.db'))
+
+    for key, value in result.items():
+        print(f'  {key}: {value}')
+
+    ok = (
+        result['floor'] > 0
+        and result['stale_status'] == 410
+        and result['resync_410s'] == 0
+        and result['resync_matches']
+        and result['restarted_410s'] == 1
+        and result['restarted_matches']
+    )
+    print('OK' if ok else 'FAILED')
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,284 @@
+"""
+Multi-threaded load test for the whole app.
+
+Seeds a temporary SQLite database, serves the app on a threaded WSGI server
+and replays a weighted workload profile at the given concurrency. Prints a
+JSON report with throughput, p50/p99 latency per operation and the error
+and lock-timeout rates.
+Run with: python -m tests.load_test [--profile mixed] [--concurrency 16] [--duration 20]
+"""
+
+import argparse
+import http.client
+import itertools
+import json
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+from collections import defaultdict
+from urllib.parse import urlencode
+
+# Add parent directory to path for imports
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Relative weights of each operation per profile
+PROFILES = {
+    'autocomplete': {'autocomplete': 8, 'catalog': 1, 'search_fuzzy': 1},
+    'read-heavy': {'autocomplete': 3, 'search_exact': 2, 'search_fuzzy': 3, 'edit_paging': 2},
+    'mixed': {'autocomplete': 3, 'search_exact': 2, 'search_fuzzy': 2, 'edit_paging': 1,
+              'dish_save': 1, 'ingredient_create': 1},
+    'write-heavy': {'search_fuzzy': 1, 'dish_save': 3, 'ingredient_create': 2},
+}
+
+SYLLABLES = ['か', 'き', 'く', 'さ', 'し', 'た', 'な', 'ま', 'も', 'ら', 'り', 'ん', 'ご', 'ぶ']
+
+
+def seed_database(dish_count, ingredient_count, rng):
+    """Insert a synthetic catalog and dishes (inside an app context)"""
+    from app import db
+    from app.changes import seed_change_log
+    from app.models import Dish, Ingredient, dish_genre_relations, dish_ingredient_relations
+    from app.summaries import rebuild_dish_summaries
+
+    ingredients = []
+    for i in range(1, ingredient_count + 1):
+        name = ''.join(rng.choice(SYLLABLES) for _ in range(3)) + str(i)
+        ingredients.append({'id': i, 'name': name, 'category_id': i % 5 + 1, 'display_order': i})
+    db.session.execute(db.insert(Ingredient), ingredients)
+
+    dishes, genre_rows, ingredient_rows = [], [], []
+    for i in range(1, dish_count + 1):
+        dishes.append({'id': i, 'name': f'料理{i}', 'difficulty': rng.randint(1, 5), 'memo': ''})
+        for genre_id in rng.sample(range(1, 9), rng.randint(1, 2)):
+            genre_rows.append({'dish_id': i, 'genre_id': genre_id})
+        for ingredient_id in rng.sample(range(1, ingredient_count + 1), rng.randint(1, 10)):
+            ingredient_rows.append({'dish_id': i, 'ingredient_id': ingredient_id})
+    db.session.execute(db.insert(Dish), dishes)
+    db.session.execute(dish_genre_relations.insert(), genre_rows)
+    db.session.execute(dish_ingredient_relations.insert(), ingredient_rows)
+
+    conn = db.session.connection()
+    rebuild_dish_summaries(conn)
+    seed_change_log(conn)
+    db.session.commit()
+    return [i['name'] for i in ingredients]
+
+
+class Client:
+    """Minimal HTTP client that does not follow redirects"""
+
+    def __init__(self, host, port):
+        self.host = host
+        self.port = port
+
+    def request(self, method, path, body=None, headers=None):
+        conn = http.client.HTTPConnection(self.host, self.port, timeout=60)
+        try:
+            conn.request(method, path, body=body, headers=headers or {})
+            response = conn.getresponse()
+            response.read()
+            return response.status
+        finally:
+            conn.close()
+
+
+def make_operations(client, ingredient_names, dish_count, rng, counter):
+    """Build the operation callables; each yields (name, status) per request"""
+    ingredient_count = len(ingredient_names)
+
+    def autocomplete():
+        name = rng.choice(ingredient_names)
+        for n in range(1, len(name) + 1):
+            yield 'autocomplete', client.request('GET', '/ingredient/search?' + urlencode({'q': name[:n]}))
+
+    def catalog():
+        yield 'catalog', client.request('GET', '/api/catalog', headers={'Accept-Encoding': 'gzip'})
+
+    def search(mode):
+        ids = rng.sample(range(1, ingredient_count + 1), rng.randint(1, 3))
+        query = {'ingredient_ids': ','.join(map(str, ids)), 'mode': mode}
+        if rng.random() < 0.3:
+            query['genre_ids'] = str(rng.randint(1, 8))
+        yield f'search_{mode}', client.request('GET', '/search?' + urlencode(query))
+
+    def edit_paging():
+        per_page = rng.choice([10, 20, 50])
+        page = rng.randint(1, max(dish_count // per_page, 1))
+        yield 'edit_paging', client.request('GET', '/edit?' + urlencode({'page': page, 'per_page': per_page}))
+
+    def dish_save():
+        dish_id = rng.randint(1, dish_count)
+        ids = rng.sample(range(1, ingredient_count + 1), rng.randint(1, 10))
+        body = urlencode([
+            ('name', f'料理{dish_id}'),
+            ('difficulty', rng.randint(1, 5)),
+            ('genre_ids', rng.randint(1, 8)),
+            ('ingredient_ids', ','.join(map(str, ids))),
+            ('referrer', '/edit'),
+        ])
+        yield 'dish_save', client.request('POST', f'/dish/{dish_id}/edit', body=body, headers={
+            'Content-Type': 'application/x-www-form-urlencoded'
+        })
+
+    def ingredient_create():
+        body = json.dumps({'name': f'負荷{next(counter)}', 'category_id': rng.randint(1, 5)})
+        yield 'ingredient_create', client.request('POST', '/api/ingredient', body=body, headers={
+            'Content-Type': 'application/json'
+        })
+
+    return {
+        'autocomplete': autocomplete,
+        'catalog': catalog,
+        'search_exact': lambda: search('exact'),
+        'search_fuzzy': lambda: search('fuzzy'),
+        'edit_paging': edit_paging,
+        'dish_save': dish_save,
+        'ingredient_create': ingredient_create,
+    }
+
+
+def percentile(sorted_values, p):
+    """Nearest-rank percentile of an already sorted list"""
+    if not sorted_values:
+        return None
+    index = max(int(round(p / 100 * len(sorted_values) + 0.5)) - 1, 0)
+    return sorted_values[min(index, len(sorted_values) - 1)]
+
+
+def run(profile, concurrency, duration, dish_count, ingredient_count, database_path, seed=0):
+    """Run one load test and return the report dict."""
+    os.environ['DATABASE_PATH'] = database_path
+
+    from flask import got_request_exception
+    from werkzeug.serving import WSGIRequestHandler, make_server
+
+    from app import create_app, db
+
+    app = create_app('testing')
+    app.config['PROPAGATE_EXCEPTIONS'] = False
+
+    with app.app_context():
+        ingredient_names = seed_database(dish_count, ingredient_count, random.Random(seed))
+        db.session.remove()
+
+    # Count server-side lock timeouts, which otherwise only surface as 500s
+    lock_timeouts = [0]
+    lock_timeouts_lock = threading.Lock()
+
+    def on_exception(sender, exception, **extra):
+        if 'database is locked' in str(exception):
+            with lock_timeouts_lock:
+                lock_timeouts[0] += 1
+
+    got_request_exception.connect(on_exception, app)
+
+    class QuietHandler(WSGIRequestHandler):
+        def log_request(self, *args, **kwargs):
+            pass
+
+    server = make_server('127.0.0.1', 0, app, threaded=True, request_handler=QuietHandler)
+    server_thread = threading.Thread(target=server.serve_forever, daemon=True)
+    server_thread.start()
+
+    weights = PROFILES[profile]
+    names = list(weights)
+    latencies = defaultdict(list)
+    errors = defaultdict(int)
+    results_lock = threading.Lock()
+    names_counter = itertools.count(1)  # next() on a count is atomic
+    deadline = time.perf_counter() + duration
+
+    def worker(n):
+        rng = random.Random(seed * 1000 + n + 1)
+        client = Client('127.0.0.1', server.server_port)
+        operations = make_operations(client, ingredient_names, dish_count, rng, names_counter)
+        while time.perf_counter() < deadline:
+            operation = operations[rng.choices(names, weights=[weights[k] for k in names])[0]]
+            requests_iter = operation()
+            while True:
+                started = time.perf_counter()
+                try:
+                    name, status = next(requests_iter)
+                except StopIteration:
+                    break
+                except (OSError, http.client.HTTPException):
+                    name, status = 'connection', None
+                elapsed_ms = (time.perf_counter() - started) * 1000
+                with results_lock:
+                    latencies[name].append(elapsed_ms)
+                    if status is None or status >= 500:
+                        errors[name] += 1
+                if status is None:
+                    break
+
+    started = time.perf_counter()
+    workers = [threading.Thread(target=worker, args=(n,)) for n in range(concurrency)]
+    for t in workers:
+        t.start()
+    for t in workers:
+        t.join()
+    elapsed = time.perf_counter() - started
+
+    server.shutdown()
+    with app.app_context():
+        db.session.remove()
+        db.engine.dispose()
+
+    total_requests = sum(len(v) for v in latencies.values())
+    total_errors = sum(errors.values())
+    endpoints = {}
+    for name, values in sorted(latencies.items()):
+        values.sort()
+        endpoints[name] = {
+            'requests': len(values),
+            'throughput_rps': round(len(values) / elapsed, 1),
+            'p50_ms': round(percentile(values, 50), 2),
+            'p99_ms': round(percentile(values, 99), 2),
+            'errors': errors[name],
+        }
+
+    return {
+        'profile': profile,
+        'concurrency': concurrency,
+        'duration_sec': round(elapsed, 2),
+        'dataset': {'dishes': dish_count, 'ingredients': ingredient_count},
+        'total': {
+            'requests': total_requests,
+            'throughput_rps': round(total_requests / elapsed, 1),
+            'errors': total_errors,
+            'error_rate': round(total_errors / total_requests, 4) if total_requests else 0,
+            'lock_timeouts': lock_timeouts[0],
+            'lock_timeout_rate': round(lock_timeouts[0] / total_requests, 4) if total_requests else 0,
+        },
+        'endpoints': endpoints,
+    }
+
+
+def main():
+    """Main entry point."""
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--profile', choices=sorted(PROFILES), default='mixed')
+    parser.add_argument('--concurrency', type=int, default=16)
+    parser.add_argument('--duration', type=float, default=20, help='seconds')
+    parser.add_argument('--dishes', type=int, default=5000)
+    parser.add_argument('--ingredients', type=int, default=300)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help='also write the JSON report to this file')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        report = run(args.profile, args.concurrency, args.duration, args.dishes,
+                     args.ingredients, os.path.join(tmp, 'load.db'), seed=args.seed)
+
+    text = json.dumps(report, ensure_ascii=False, indent=2)
+    print(text)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(text + '\n')
+
+
+if __name__ == '__main__':
+    main()
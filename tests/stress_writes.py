@@ -0,0 +1,104 @@
+"""
+Concurrent write stress test.
+
+Hammers /api/ingredient from many threads (including deliberate duplicate
+names) and checks that no write is lost, duplicates come back as 409 and
+display_order stays unique within each category.
+Run with: python -m tests.stress_writes [--threads N] [--writes N]
+"""
+
+import argparse
+import os
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter
+
+# Add parent directory to path for imports
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def run(threads, writes_per_thread, database_path):
+    """Run the stress test and return a dict of results."""
+    os.environ['DATABASE_PATH'] = database_path
+
+    from app import create_app, db
+    from app.models import Ingredient
+
+    app = create_app('testing')
+    category_ids = [1, 2, 3, 4, 5]
+
+    statuses = Counter()
+    statuses_lock = threading.Lock()
+    barrier = threading.Barrier(threads)
+
+    def worker(n):
+        client = app.test_client()
+        barrier.wait()
+        for i in range(writes_per_thread):
+            # Every 5th write reuses a name shared by all threads
+            name = f'dup-{i}' if i % 5 == 0 else f'stress-{n}-{i}'
+            response = client.post('/api/ingredient', json={
+                'name': name,
+                'category_id': category_ids[i % len(category_ids)],
+            })
+            with statuses_lock:
+                statuses[response.status_code] += 1
+
+    pool = [threading.Thread(target=worker, args=(n,)) for n in range(threads)]
+    started = time.perf_counter()
+    for t in pool:
+        t.start()
+    for t in pool:
+        t.join()
+    elapsed = time.perf_counter() - started
+
+    with app.app_context():
+        rows = Ingredient.query.all()
+        names = Counter(i.name for i in rows)
+        orders = Counter((i.category_id, i.display_order) for i in rows)
+        db.session.remove()
+        db.engine.dispose()
+
+    unique_dups = len({i for i in range(writes_per_thread) if i % 5 == 0})
+    expected_rows = threads * (writes_per_thread - unique_dups) + unique_dups
+
+    return {
+        'requests': sum(statuses.values()),
+        'statuses': dict(statuses),
+        'rows': len(rows),
+        'expected_rows': expected_rows,
+        'duplicate_names': sum(1 for c in names.values() if c > 1),
+        'duplicate_display_orders': sum(1 for c in orders.values() if c > 1),
+        'elapsed_sec': round(elapsed, 3),
+        'writes_per_sec': round(statuses[200] / elapsed, 1) if elapsed else 0,
+    }
+
+
+def main():
+    """Main entry point."""
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--threads', type=int, default=16)
+    parser.add_argument('--writes', type=int, default=50, help='writes per thread')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        result = run(args.threads, args.writes, os.path.join(tmp, 'stress.db'))
+
+    for key, value in result.items():
+        print(f'  {key}: {value}')
+
+    ok = (
+        result['rows'] == result['expected_rows']
+        and result['statuses'].get(200, 0) == result['expected_rows']
+        and set(result['statuses']) <= {200, 409}
+        and result['duplicate_names'] == 0
+        and result['duplicate_display_orders'] == 0
+    )
+    print('OK' if ok else 'FAILED')
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == '__main__':
+    main()